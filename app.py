@@ -1,12 +1,19 @@
+from async_helpers import get_movie_view_async, get_saved_movies_async, search_query_async
+from cache_warmer import CacheWarmer, warm_cache
+from catalog import export_url, ingest_catalog
 from datetime import timedelta
 from dotenv import load_dotenv
-from external_variables import FLASH_KEY
-from flask import Flask, flash, get_flashed_messages, jsonify, redirect, render_template, request, session, url_for
-from flask_mail import Mail, Message
-from flask_session import Session
-from helpers import create_form, create_tables, format_movie_info, get_cast_info, get_movie_info, get_movie_release_info, get_saved_movies, is_logged_in, is_movie_saved, remove_movie, save_movie, search_query, validate_form_data
+from external_variables import ASYNC_VIEWS, CACHE_WARMER, CACHE_WARMER_BUDGET, CACHE_WARMER_LEAD, CACHE_WARMER_TOP_MOVIES, CATALOG_BATCH_SIZE, FLASH_KEY, MAIL_PORT, MAIL_SERVER, MAIL_USE_TLS, METRICS_ENABLED, OUTBOX_WORKER, SEARCH_STREAM_MAX_PAGES, USE_X_SENDFILE, WATCHLIST_BULK_MAX_IDS
+from flask import Flask, Response, abort, before_render_template, flash, get_flashed_messages, jsonify, make_response, redirect, render_template, request, send_file, session, stream_with_context, template_rendered, url_for
+from flask_mail import Mail
+from helpers import WATCHLIST_SORTS, backfill_watchlist, bulk_update_watchlist, close_db_connection, compress_response, create_form, create_tables, export_watchlist, get_movie_view, get_saved_movies, import_watchlist, is_logged_in, is_movie_saved, movie_etag, not_modified, parse_movie_ids, partial_movie_view, purge_tmdb_cache, remove_movie, save_movie, search_etag, search_query, set_etag, stream_search_query, validate_form_data, watchlist_etag, watchlist_options
 from itsdangerous import SignatureExpired, URLSafeTimedSerializer
-import os, secrets
+from metrics import finish_request_timing, finish_template_timing, render_metrics, start_request_timing, start_template_timing
+from outbox import OutboxWorker, queue_email
+from posters import poster_cache
+from sqlite_session import SqliteSessionInterface
+from tmdb import TMDB_ERRORS, tmdb_breaker
+import click, os, secrets, threading
 
 # Load env variables
 load_dotenv()
@@ -17,21 +24,56 @@ app = Flask(__name__)
 # Creates necessary tables for database
 create_tables()
 
+# One database connection per request, closed when the request ends
+app.teardown_appcontext(close_db_connection)
+
+# Time each request, registered first so the timing covers the other hooks
+if METRICS_ENABLED:
+    app.before_request(start_request_timing)
+    app.after_request(finish_request_timing)
+    before_render_template.connect(start_template_timing, app)
+    template_rendered.connect(finish_template_timing, app)
+
 app.config["SECRET_KEY"] = secrets.token_urlsafe(16)
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=30)
-app.config["SESSION_TYPE"] = "filesystem"
 app.config["SESSION_PERMANENT"] = False
-Session(app)
+app.config["USE_X_SENDFILE"] = USE_X_SENDFILE
+app.session_interface = SqliteSessionInterface(app, permanent=False)
 
 # Configuration for Flask-Mail
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config['MAIL_PORT'] = 587
+app.config["MAIL_SERVER"] = MAIL_SERVER
+app.config['MAIL_PORT'] = MAIL_PORT
 app.config['MAIL_USERNAME'] = os.getenv("EMAIL")
 app.config['MAIL_PASSWORD'] = os.getenv("EMAIL_PASSWORD")
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_USE_TLS'] = MAIL_USE_TLS
 app.config['MAIL_USE_SSL'] = False
 
 mail = Mail(app)
+
+# Sends queued emails in the background so requests don't wait on SMTP
+outbox_worker = OutboxWorker(app, mail, os.getenv("EMAIL"))
+
+# Background threads are started by the first request a process serves, so CLI
+# commands never run them and forking servers start them in every worker
+background_started = False
+background_lock = threading.Lock()
+
+@app.before_request
+def start_background_workers():
+    """Starts the background workers the first time this process handles a request"""
+    global background_started
+    if background_started:
+        return
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    app.session_interface.start_sweeper()
+    if OUTBOX_WORKER:
+        outbox_worker.start()
+    # Keeps the most saved movies cached so homepage visits rarely wait on TMDB
+    if CACHE_WARMER:
+        CacheWarmer(app).start()
 s = URLSafeTimedSerializer(app.secret_key)
 
 @app.before_request
@@ -53,12 +95,32 @@ def check_session():
 @app.route('/')
 def index():
     """Homepage for signed in user"""
-    user = is_logged_in(session.get("user_id", None))
-    movies = None
+    user_id = session.get("user_id", None)
+    options = watchlist_options()
+    # Repeat visits with an unchanged watchlist skip the queries and rendering
+    cached = not_modified(watchlist_etag(user_id, *options))
+    if cached:
+        return cached
+
+    user = is_logged_in(user_id)
+    watchlist = None
     if user:
-        movies = get_saved_movies(user.get("id"))
-    print(movies)
-    return render_template("index.html", user=user, movies=movies)
+        watchlist = get_saved_movies(user.get("id"), *options)
+    return render_index(user_id, user, watchlist, options)
+
+
+def render_index(user_id, user, watchlist, options):
+    """Renders the homepage, with an ETag unless a movie is a placeholder for details that didn't load"""
+    movies = watchlist["movies"] if watchlist else None
+    has_placeholders = any(movie.get("placeholder") and not movie.get("not_found") for movie in movies or [])
+    # Placeholders are missing because TMDB is down rather than slow, say so on the page
+    partial = has_placeholders and tmdb_breaker.is_open()
+    response = make_response(render_template("index.html", user=user, movies=movies, watchlist=watchlist, sorts=WATCHLIST_SORTS, partial=partial))
+    # Pages with placeholders are never cached so the missing movies load next time
+    etag = watchlist_etag(user_id, *options)
+    if etag and not has_placeholders:
+        set_etag(response, etag)
+    return response
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -97,17 +159,12 @@ def forgot_password():
         form_data = request.form
         if validate_form_data(form_data, form):
             token = s.dumps(form_data["email"], salt="email-confirm")
-            msg = Message("MovieList Password Reset Request", sender=os.getenv("EMAIL"), recipients=[form_data["email"]])
             link = url_for("reset_password", token=token, _external=True)
-            msg.body = f"Your password reset link is {link}"
-            try:
-                mail.send(msg)
-                session[FLASH_KEY] = "success"
-                flash("Password reset link has been sent to your email", session.get(FLASH_KEY))
-                return redirect(url_for("login"))
-            except:
-                session[FLASH_KEY] = "danger"
-                flash("Error sending email. Please try again.", session.get(FLASH_KEY))
+            # Sent by the outbox worker, respond as soon as it is queued
+            queue_email(form_data["email"], "MovieList Password Reset Request", f"Your password reset link is {link}")
+            session[FLASH_KEY] = "success"
+            flash("Password reset link has been sent to your email", session.get(FLASH_KEY))
+            return redirect(url_for("login"))
 
     return render_template("entry-forms.html", form=form, no_search=True)
 
@@ -148,22 +205,109 @@ def logout():
 @app.route("/movie")
 def movie():
     """Page for individual movie information"""
-    movie_id = request.args.get("id")
-    movie_info = get_movie_info(movie_id)
-    release_info = get_movie_release_info(movie_id)
-    cast_info = get_cast_info(movie_id)
-    formatted_movie_info = format_movie_info(movie_info, release_info, cast_info)
+    movie_id = requested_movie_id()
     # Check if movie is saved to users list
     is_saved = is_movie_saved(movie_id)
-    return render_template("movie.html", movie=formatted_movie_info, is_saved=is_saved)
+    # Pending flash messages are shown on the page, so it must be rendered
+    has_flashes = "_flashes" in session
+    if not has_flashes:
+        cached = not_modified(movie_etag(movie_id, is_saved))
+        if cached:
+            return cached
+
+    try:
+        formatted_movie_info = get_movie_view(movie_id)
+    except TMDB_ERRORS:
+        return render_partial_movie(movie_id, is_saved)
+    return render_movie(movie_id, formatted_movie_info, is_saved, has_flashes)
+
+
+def requested_movie_id():
+    """Returns the id query string parameter, 404 before any lookup if it isn't a movie id"""
+    try:
+        return parse_movie_ids([request.args.get("id")])[0]
+    except ValueError:
+        abort(404)
+
+
+def render_movie(movie_id, formatted_movie_info, is_saved, has_flashes):
+    """Renders the movie page, with an ETag unless it shows flash messages"""
+    if formatted_movie_info is None:
+        abort(404)
+    response = make_response(render_template("movie.html", movie=formatted_movie_info, is_saved=is_saved))
+    etag = None if has_flashes else movie_etag(movie_id, is_saved)
+    if etag:
+        set_etag(response, etag)
+    return response
+
+
+def render_partial_movie(movie_id, is_saved):
+    """
+        Renders the movie page from the details stored locally when TMDB can't be reached.
+        The page is marked as partial and never cached, 503 if nothing is stored for the movie.
+    """
+    formatted_movie_info = partial_movie_view(movie_id)
+    if formatted_movie_info is None:
+        abort(503)
+    response = make_response(render_template("movie.html", movie=formatted_movie_info, is_saved=is_saved, partial=True))
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/poster/<size>/<name>")
+def poster(size, name):
+    """Serves a TMDB poster from the local poster cache"""
+    path = poster_cache.get(size, name)
+    if not path:
+        # Short cache time so a poster added to TMDB later still shows up
+        return send_file(os.path.join(app.static_folder, "imgs", "image-not-found-vector.jpg"), max_age=60 * 60)
+    response = send_file(path, max_age=60 * 60 * 24 * 365)
+    response.cache_control.immutable = True
+    return response
+
+
+def requested_overview_chars():
+    """Returns the overview query string parameter, None when it is missing or not a positive number of characters"""
+    overview_chars = request.args.get("overview", type=int)
+    return overview_chars if overview_chars is not None and overview_chars > 0 else None
 
 
 @app.route("/search-results")
 def results():
-    """Calls the api to get movie search results"""
+    """
+        Calls the api to get movie search results.
+        Returns one page, or with stream=1 newline delimited json pages as they arrive.
+        With local=1 the first page may come from the local title index, as a single page.
+    """
     query = request.args.get("q")
     if query:
-        return search_query(query)
+        compact = request.args.get("compact") == "1"
+        overview_chars = requested_overview_chars()
+        if request.args.get("stream") == "1":
+            max_pages = min(request.args.get("pages", SEARCH_STREAM_MAX_PAGES, type=int), SEARCH_STREAM_MAX_PAGES)
+            return Response(stream_search_query(query, compact, overview_chars, max_pages), mimetype="application/x-ndjson")
+        page = request.args.get("page", 1, type=int)
+        local = request.args.get("local") == "1"
+        cached = search_not_modified(search_etag(query, compact, overview_chars, page, local))
+        if cached:
+            return cached
+        response = search_query(query, compact, overview_chars, page, local)
+        return search_results_response(response, search_etag(query, compact, overview_chars, page, local))
+
+
+def search_not_modified(etag):
+    """Returns 304 if the client has the cached page of search results, otherwise None"""
+    cached = not_modified(etag, private=False)
+    if cached:
+        cached.vary.add("Accept-Encoding")
+    return cached
+
+
+def search_results_response(response, etag):
+    """Compresses a page of search results and sets its ETag, pages that weren't cached get none"""
+    if response.status_code != 200 or etag is None:
+        return compress_response(response)
+    return set_etag(compress_response(response), etag, private=False)
 
 
 @app.route("/search")
@@ -188,4 +332,177 @@ def remove():
     if request.method == "DELETE":
         movie_id = request.args.get("id")
         remove_movie(movie_id)
-        return jsonify({"success": True, "redirect_url": url_for("movie", id=movie_id)})
\ No newline at end of file
+        return jsonify({"success": True, "redirect_url": url_for("movie", id=movie_id)})
+
+
+@app.route("/watchlist/bulk", methods=["POST"])
+def bulk_watchlist():
+    """Adds and removes many movies in one transaction, body is {"add": [ids], "remove": [ids]}"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"success": False, "error": "Must be logged in to change your list."}), 401
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("add", []), list) or not isinstance(body.get("remove", []), list):
+        return jsonify({"success": False, "error": "Body must be a json object with add and remove lists."}), 400
+    try:
+        add = parse_movie_ids(body.get("add", []))
+        remove = parse_movie_ids(body.get("remove", []))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if len(add) + len(remove) > WATCHLIST_BULK_MAX_IDS:
+        return jsonify({"success": False, "error": f"At most {WATCHLIST_BULK_MAX_IDS} movie ids per request."}), 413
+    added, removed = bulk_update_watchlist(user_id, add, remove)
+    return jsonify({"success": True, "added": added, "removed": removed})
+
+
+@app.route("/watchlist/export")
+def export():
+    """Downloads the watchlist as csv, or json lines with format=jsonl, streamed as it is read"""
+    user_id = session.get("user_id")
+    if not user_id:
+        abort(401)
+    format = "jsonl" if request.args.get("format") == "jsonl" else "csv"
+    mimetype = "application/x-ndjson" if format == "jsonl" else "text/csv"
+    response = Response(stream_with_context(export_watchlist(user_id, format)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=watchlist.{format}"
+    return response
+
+
+@app.route("/watchlist/import", methods=["POST"])
+def import_list():
+    """
+        Saves the movie ids in an uploaded csv or json lines file, sent as the
+        file form field or as the request body. The format comes from
+        ?format= or the file name, csv by default.
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"success": False, "error": "Must be logged in to import a list."}), 401
+    upload = request.files.get("file")
+    name = upload.filename if upload else ''
+    format = request.args.get("format") or ("jsonl" if name.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    if format not in ("csv", "jsonl"):
+        return jsonify({"success": False, "error": "Format must be csv or jsonl."}), 400
+    try:
+        saved, skipped = import_watchlist(user_id, upload.stream if upload else request.stream, format)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "added": saved, "skipped": skipped})
+
+
+@app.route("/metrics")
+def metrics():
+    """Latency histograms for this worker process in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        abort(404)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+async def index_async():
+    """Homepage for signed in user, unloaded watchlist movies are loaded with the async TMDB client"""
+    user_id = session.get("user_id", None)
+    options = watchlist_options()
+    cached = not_modified(watchlist_etag(user_id, *options))
+    if cached:
+        return cached
+
+    user = is_logged_in(user_id)
+    watchlist = None
+    if user:
+        watchlist = await get_saved_movies_async(user.get("id"), *options)
+    return render_index(user_id, user, watchlist, options)
+
+
+async def movie_async():
+    """Page for individual movie information, loaded with the async TMDB client"""
+    movie_id = requested_movie_id()
+    is_saved = is_movie_saved(movie_id)
+    has_flashes = "_flashes" in session
+    if not has_flashes:
+        cached = not_modified(movie_etag(movie_id, is_saved))
+        if cached:
+            return cached
+
+    try:
+        formatted_movie_info = await get_movie_view_async(movie_id)
+    except TMDB_ERRORS:
+        return render_partial_movie(movie_id, is_saved)
+    return render_movie(movie_id, formatted_movie_info, is_saved, has_flashes)
+
+
+async def results_async():
+    """Movie search results, a single page is loaded with the async TMDB client"""
+    query = request.args.get("q")
+    if query:
+        if request.args.get("stream") == "1":
+            return results()
+        compact = request.args.get("compact") == "1"
+        overview_chars = requested_overview_chars()
+        page = request.args.get("page", 1, type=int)
+        local = request.args.get("local") == "1"
+        cached = search_not_modified(search_etag(query, compact, overview_chars, page, local))
+        if cached:
+            return cached
+        response = await search_query_async(query, compact, overview_chars, page, local)
+        return search_results_response(response, search_etag(query, compact, overview_chars, page, local))
+
+
+# Swap in the async views, each worker thread then overlaps all of a page's TMDB calls
+if ASYNC_VIEWS:
+    app.view_functions["index"] = index_async
+    app.view_functions["movie"] = movie_async
+    app.view_functions["results"] = results_async
+
+
+@app.cli.command("purge-cache")
+@click.option("--id", "movie_id", type=int, help="Only purge the cached payloads for this movie id")
+def purge_cache(movie_id):
+    """Deletes cached TMDB payloads for one movie or the whole cache"""
+    deleted = purge_tmdb_cache(movie_id)
+    click.echo(f"Purged {deleted} cached payloads")
+
+
+@app.cli.command("backfill-watchlist")
+@click.option("--batch-size", default=100, show_default=True, help="Movie ids loaded at once")
+def backfill_watchlist_command(batch_size):
+    """Fills in the details of saved movies that were saved before the watchlist columns existed"""
+    filled, failed = backfill_watchlist(batch_size, lambda filled, failed: click.echo(f"Filled {filled} movies, {failed} failed"))
+    click.echo(f"Backfill done: filled {filled} movies, {failed} failed to load")
+
+
+@app.cli.command("ingest-catalog")
+@click.argument("source", required=False)
+@click.option("--date", type=click.DateTime(["%Y-%m-%d"]), help="Download TMDB's export for this day instead, defaults to yesterday")
+@click.option("--batch-size", default=CATALOG_BATCH_SIZE, show_default=True, help="Export lines written in each transaction")
+@click.option("--restart", is_flag=True, help="Load the export from the start even if an earlier run loaded some or all of it")
+def ingest_catalog_command(source, date, batch_size, restart):
+    """Loads a TMDB daily movie id export, from a url or a local .json.gz file, into the movie catalog"""
+    source = source or export_url(date and date.date())
+    click.echo(f"Loading {source}")
+    lines, invalid = ingest_catalog(source, batch_size, restart, lambda done: click.echo(f"Loaded {done} lines"))
+    click.echo(f"Catalog ingest done: loaded {lines} lines, {invalid} could not be read")
+
+
+@app.cli.command("warm-cache")
+@click.option("--budget", default=CACHE_WARMER_BUDGET, show_default=True, help="Most TMDB calls to make")
+@click.option("--top", default=CACHE_WARMER_TOP_MOVIES, show_default=True, help="Number of most saved movies to keep warm")
+@click.option("--lead", default=CACHE_WARMER_LEAD, show_default=True, help="Seconds before going stale that a cached payload is refreshed")
+def warm_cache_command(budget, top, lead):
+    """Refreshes the cached TMDB payloads of the most saved movies before they go stale"""
+    def report(stats):
+        click.echo(f"Refreshed {stats['refreshed']} of {stats['due']} due payloads with {stats['calls']} calls, {stats['failed']} failed")
+    stats = warm_cache(budget, top, lead, report)
+    click.echo(f"Cache warm done: refreshed {stats['refreshed']} payloads with {stats['calls']} TMDB calls, "
+               f"{stats['failed']} failed, {stats['missing']} missing on TMDB, {stats['remaining']} still due")
+
+
+@app.cli.command("send-outbox")
+def send_outbox():
+    """Sends every due email in the outbox once and exits"""
+    # Its own worker, so its SMTP connection is never shared with a background thread
+    worker = OutboxWorker(app, mail, os.getenv("EMAIL"))
+    total = 0
+    while sent := worker.send_due():
+        total += sent
+    worker.close()
+    click.echo(f"Processed {total} outbox emails")
\ No newline at end of file
@@ -0,0 +1,163 @@
+from external_variables import TMDB_APPEND_TO_RESPONSE, TMDB_CACHE_TTL, WATCHLIST_DEADLINE, WATCHLIST_MAX_CONCURRENCY
+from flask import Response
+from helpers import MOVIE_DETAILS_PARAMS, backed_off_movies, catalog_search_page, fill_watchlist_movies, fresh_cached_payload, fresh_movie_details, get_local_search_page, handle_movie_details_response, handle_payload_response, handle_search_response, is_stale, normalize_query, payload_request, read_cached_payloads, read_movie_view, read_watchlist, schedule_cache_refresh, search_cache_key, search_params, store_movie_view
+from single_flight import single_flight
+from tmdb import TMDB_ERRORS, async_tmdb_client, tmdb_breaker
+import asyncio
+
+# Async versions of the TMDB helpers used by the async views. The cache,
+# search index and movie view logic is shared with helpers.py, only the
+# TMDB calls are awaited so one worker thread can overlap many of them.
+
+
+async def get_movie_info_async(id):
+    """Returns individual movie info based on IMDB id"""
+    return await get_cached_payload_async(id, "details")
+
+
+async def get_movie_release_info_async(id):
+    """Get release date info for individual movie based on IMDB id"""
+    return await get_cached_payload_async(id, "release_dates")
+
+
+async def get_cast_info_async(id):
+    """Get the cast list and director for movie"""
+    return await get_cached_payload_async(id, "credits")
+
+
+async def get_cached_payload_async(id, payload_type):
+    """
+        Returns a TMDB payload for the movie from the cache, fetching it on a miss.
+        A stale payload is returned as is and refreshed in the background.
+    """
+    cached = read_cached_payloads(id, payload_type)
+    if payload_type in cached:
+        payload, fetched_at = cached[payload_type]
+        if is_stale(payload_type, fetched_at):
+            schedule_cache_refresh(id, payload_type)
+        return payload
+    return await fetch_payload_async(id, payload_type)
+
+
+async def fetch_payload_async(id, payload_type):
+    """Makes the TMDB call for a single payload type and stores it, see fetch_payload"""
+    tmdb_breaker.check()
+    return await single_flight.do_async(f"payload:{id}:{payload_type}", lambda: request_payload_async(id, payload_type),
+        recheck=lambda: fresh_cached_payload(id, payload_type))
+
+
+async def request_payload_async(id, payload_type):
+    """Makes the TMDB call for fetch_payload_async"""
+    endpoint, path, params = payload_request(id, payload_type)
+    response = await async_tmdb_client.get(endpoint, path, **params)
+    return handle_payload_response(id, payload_type, response.status_code, response.content)
+
+
+async def get_movie_details_async(id):
+    """
+        Returns the movie info, release info and cast info for a movie.
+        Served from the cache when all three are stored, otherwise uses the
+        combined append_to_response call or the three calls concurrently,
+        see get_movie_details.
+    """
+    cached = read_cached_payloads(id)
+    if len(cached) == len(TMDB_CACHE_TTL):
+        if any(is_stale(payload_type, fetched_at) for payload_type, (_, fetched_at) in cached.items()):
+            schedule_cache_refresh(id)
+        return cached["details"][0], cached["release_dates"][0], cached["credits"][0]
+
+    if TMDB_APPEND_TO_RESPONSE:
+        tmdb_breaker.check()
+        details = await single_flight.do_async(f"movie_details:{id}", lambda: request_movie_details_async(id),
+            recheck=lambda: fresh_movie_details(id))
+        if details:
+            return details
+
+    return await asyncio.gather(get_movie_info_async(id), get_movie_release_info_async(id), get_cast_info_async(id))
+
+
+async def request_movie_details_async(id):
+    """Makes the combined movie details call, see fetch_movie_details"""
+    response = await async_tmdb_client.get("movie_details", f"/movie/{id}", **MOVIE_DETAILS_PARAMS)
+    return handle_movie_details_response(id, response.status_code, response.content)
+
+
+async def get_movie_view_async(id):
+    """Returns the formatted movie page info for a movie, see get_movie_view"""
+    view = read_movie_view(id)
+    if view is None:
+        view = store_movie_view(id, *await get_movie_details_async(id))
+    return view
+
+
+async def get_saved_movies_async(user_id, sort="added", genre=None, page=1):
+    """Returns a page of the saved movies for the user id, see get_saved_movies"""
+    watchlist = read_watchlist(user_id, sort, genre, page)
+    missing = [movie["id"] for movie in watchlist["movies"] if movie["title"] is None]
+    if missing:
+        backed_off = backed_off_movies(missing)
+        loaded = await hydrate_movies_async([id for id in missing if id not in backed_off])
+        fill_watchlist_movies(watchlist["movies"], loaded, backed_off_movies(missing))
+    return watchlist
+
+
+async def hydrate_movies_async(movie_ids, max_concurrency=WATCHLIST_MAX_CONCURRENCY, deadline=WATCHLIST_DEADLINE):
+    """
+        Fetches movie info for each id concurrently, see hydrate_movies.
+        Movies not loaded within deadline seconds, or that failed to load,
+        are returned as placeholders.
+    """
+    if tmdb_breaker.is_open():
+        return [{"id": id, "placeholder": True} for id in movie_ids]
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def load(id):
+        async with slots:
+            return await get_movie_info_async(id)
+
+    tasks = {id: asyncio.ensure_future(load(id)) for id in dict.fromkeys(movie_ids)}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=deadline)
+
+    movie_list = []
+    for id in movie_ids:
+        task = tasks[id]
+        movie = None
+        if task.done() and not task.cancelled() and not task.exception():
+            movie = task.result()
+        if movie is None:
+            movie = {"id": id, "placeholder": True}
+        movie_list.append(movie)
+    # Deadline hit, stop waiting on calls that are still running
+    for task in tasks.values():
+        task.cancel()
+    return movie_list
+
+
+async def search_query_async(query, compact=False, overview_chars=None, page=1, local=False):
+    """Makes call to api to get a page of movies, see search_query"""
+    return Response(await get_search_page_async(query, compact, overview_chars, page, local), mimetype="application/json")
+
+
+async def get_search_page_async(query, compact=False, overview_chars=None, page=1, local=False):
+    """Returns the json bytes for a page of search results, see get_search_page"""
+    query = normalize_query(query)
+    page = min(max(page, 1), 500)
+    cache_key = search_cache_key(query, compact, overview_chars, page)
+    content = get_local_search_page(cache_key, query, compact, overview_chars, page, local)
+    if content is not None:
+        return content
+    if tmdb_breaker.is_open():
+        return catalog_search_page(query, compact, overview_chars, page)
+    return await single_flight.do_async(f"search:{cache_key}", lambda: request_search_page_async(cache_key, query, compact, overview_chars, page))
+
+
+async def request_search_page_async(cache_key, query, compact=False, overview_chars=None, page=1):
+    """Makes the TMDB search call for get_search_page_async, see request_search_page"""
+    try:
+        response = await async_tmdb_client.get("search", "/search/movie", **search_params(query, page))
+    except TMDB_ERRORS:
+        return catalog_search_page(query, compact, overview_chars, page)
+    if not response.ok:
+        return catalog_search_page(query, compact, overview_chars, page)
+    return handle_search_response(cache_key, response.ok, response.content, compact, overview_chars)
@@ -0,0 +1,264 @@
+"""
+    Load test for the app against the local TMDB stub.
+    Seeds a benchmark database, starts the stub and the app, then runs
+    concurrent logged in clients through the homepage, movie page, search,
+    login and save/remove scenarios. Prints throughput and p50/p95/p99
+    latency for each scenario and can save them to compare across commits.
+    Usage: python bench/load_test.py [--duration 30] [--concurrency 20] [--latency 50]
+                                     [--error-rate 0] [--output run.json] [--compare baseline.json]
+    Pass --url to load test an app that is already running against the stub instead.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from seed_db import BENCH_PASSWORD, bench_email, seed
+from session_bench import percentile
+from tmdb_stub import WORDS
+import argparse, json, os, random, requests, shutil, subprocess, sys, tempfile, threading, time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of client iterations spent on each scenario
+SCENARIO_WEIGHTS = {"home": 40, "movie": 25, "search": 20, "save_remove": 10, "login": 5}
+
+
+def free_port():
+    """Returns a port nothing is listening on"""
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    """Waits until url answers, raising if it doesn't within timeout seconds"""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+class Client:
+    """One simulated user with its own logged in session, sends If-None-Match like a browser"""
+
+    def __init__(self, base_url, user, movies, scenarios, use_etags=True):
+        self.base_url = base_url
+        self.user = user
+        self.movies = movies
+        self.scenarios = scenarios
+        self.use_etags = use_etags
+        self.etags = {}
+        self.session = requests.Session()
+        self.rng = random.Random(user)
+
+    def request(self, method, path, **kwargs):
+        """Sends a request, returns if it succeeded"""
+        headers = kwargs.pop("headers", {})
+        if method == "GET" and self.use_etags and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        response = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        if method == "GET" and response.headers.get("ETag"):
+            self.etags[path] = response.headers["ETag"]
+        return response.status_code < 400
+
+    def login(self, session=None):
+        """Logs in with the login form, a successful login redirects to the homepage"""
+        session = session or self.session
+        response = session.post(f"{self.base_url}/login", data={"email": bench_email(self.user), "password": BENCH_PASSWORD}, allow_redirects=False)
+        return response.status_code == 302
+
+    def home(self):
+        return self.request("GET", "/")
+
+    def movie(self):
+        return self.request("GET", f"/movie?id={self.rng.randint(1, self.movies)}")
+
+    def search(self):
+        query = " ".join(self.rng.sample(WORDS, self.rng.randint(1, 2)))
+        return self.request("GET", f"/search-results?q={query}&compact=1&overview=300&page={self.rng.randint(1, 3)}")
+
+    def save_remove(self):
+        # Ids above the seeded range are never on a watchlist
+        movie_id = self.movies + self.rng.randint(1, self.movies)
+        saved = self.request("POST", f"/save-movie?id={movie_id}")
+        return self.request("DELETE", f"/remove-movie?id={movie_id}") and saved
+
+    def fresh_login(self):
+        # A new session each time, the client's own session stays logged in
+        return self.login(requests.Session())
+
+
+def run_client(client, end, results, lock):
+    """Runs weighted random scenarios until end, adding (scenario, seconds, ok) to results"""
+    scenarios = {"home": client.home, "movie": client.movie, "search": client.search,
+                 "save_remove": client.save_remove, "login": client.fresh_login}
+    names = [name for name in SCENARIO_WEIGHTS if name in client.scenarios]
+    weights = [SCENARIO_WEIGHTS[name] for name in names]
+    samples = []
+    while time.monotonic() < end:
+        name = client.rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            ok = scenarios[name]()
+        except requests.RequestException:
+            ok = False
+        samples.append((name, time.perf_counter() - start, ok))
+    with lock:
+        results.extend(samples)
+
+
+def summarize(results, duration):
+    """Returns throughput, errors and latency percentiles in ms for each scenario and in total"""
+    report = {}
+    by_scenario = {}
+    for name, seconds, ok in results:
+        by_scenario.setdefault(name, []).append((seconds, ok))
+    by_scenario["total"] = [(seconds, ok) for _, seconds, ok in results]
+    for name, samples in by_scenario.items():
+        latencies = sorted(seconds for seconds, _ in samples)
+        report[name] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "rps": len(samples) / duration,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    """Prints the report, with the change from a baseline report if one is given"""
+    print(f"{'scenario':<12} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stat in report.items():
+        print(f"{name:<12} {stat['requests']:>9} {stat['errors']:>7} {stat['rps']:>9.1f} "
+              f"{stat['p50_ms']:>9.1f} {stat['p95_ms']:>9.1f} {stat['p99_ms']:>9.1f}")
+        old = (baseline or {}).get(name)
+        if old:
+            print(f"{'  vs base':<12} {'':>9} {'':>7} {change(old['rps'], stat['rps']):>9} "
+                  f"{change(old['p50_ms'], stat['p50_ms']):>9} {change(old['p95_ms'], stat['p95_ms']):>9} {change(old['p99_ms'], stat['p99_ms']):>9}")
+
+
+def change(old, new):
+    """Returns the percent change from old to new as text"""
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+def regressions(report, baseline, max_regression):
+    """Returns the scenarios whose p95 latency got more than max_regression percent slower"""
+    return [name for name, stat in report.items()
+            if name in baseline and baseline[name]["p95_ms"] and
+            (stat["p95_ms"] - baseline[name]["p95_ms"]) / baseline[name]["p95_ms"] * 100 > max_regression]
+
+
+def git_commit():
+    """Returns the current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_app(workdir, stub_url, port, extra_env):
+    """Starts the app with the Flask development server in a subprocess"""
+    env = dict(os.environ,
+        DATABASE_NAME=os.path.join(workdir, "bench.db"),
+        TMDB_BASE_URL=f"{stub_url}/3",
+        TMDB_IMAGE_BASE_URL=f"{stub_url}/t/p",
+        TMDB_API_KEY="bench",
+        POSTER_CACHE_DIR=os.path.join(workdir, "posters"),
+        OUTBOX_WORKER="false",
+        # Off unless asked for, a warm cache would hide the TMDB latency being measured
+        CACHE_WARMER="false")
+    env.update(extra_env)
+    return subprocess.Popen([sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads", "--no-reload", "--no-debugger"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base url of an already running app, skips seeding and starting the stub and app")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds to run before measuring")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", default=",".join(SCENARIO_WEIGHTS), help="comma separated scenarios to run")
+    parser.add_argument("--no-etags", action="store_true", help="never send If-None-Match")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--watchlist", type=int, default=50)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=50, help="stub milliseconds per TMDB response")
+    parser.add_argument("--jitter", type=float, default=10, help="stub random milliseconds added or taken off the latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of stub responses answered with a 429 or 5xx")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE app setting, can be repeated, ex: --env ASYNC_VIEWS=true")
+    parser.add_argument("--output", help="save the report as json")
+    parser.add_argument("--compare", help="json report from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=10, help="with --compare, exit 1 if any p95 got this many percent slower")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    processes = []
+    try:
+        base_url = args.url
+        if not base_url:
+            print(f"Seeding {args.users} users with {args.watchlist} saved movies each")
+            seed(os.path.join(workdir, "bench.db"), args.users, args.watchlist, args.movies, args.seed)
+            stub_port, app_port = free_port(), free_port()
+            processes.append(subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "bench", "tmdb_stub.py"),
+                "--port", str(stub_port), "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate)],
+                stdout=subprocess.DEVNULL))
+            stub_url = f"http://127.0.0.1:{stub_port}"
+            processes.append(start_app(workdir, stub_url, app_port, dict(setting.split("=", 1) for setting in args.env)))
+            base_url = f"http://127.0.0.1:{app_port}"
+            wait_for(f"{stub_url}/stats")
+            wait_for(f"{base_url}/login")
+
+        scenarios = set(args.scenarios.split(","))
+        clients = []
+        for n in range(args.concurrency):
+            client = Client(base_url, n % args.users + 1, args.movies, scenarios, not args.no_etags)
+            if not client.login():
+                raise RuntimeError(f"Client {n} could not log in as {bench_email(client.user)}")
+            clients.append(client)
+
+        lock = threading.Lock()
+        if args.warmup:
+            print(f"Warming up for {args.warmup:.0f}s")
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                end = time.monotonic() + args.warmup
+                list(executor.map(lambda client: run_client(client, end, [], lock), clients))
+
+        print(f"Measuring {args.concurrency} clients for {args.duration:.0f}s")
+        results = []
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            end = time.monotonic() + args.duration
+            list(executor.map(lambda client: run_client(client, end, results, lock), clients))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = summarize(results, args.duration)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["report"]
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args), "report": report}, f, indent=2)
+        print(f"Saved report to {args.output}")
+
+    if baseline:
+        slower = regressions(report, baseline, args.max_regression)
+        if slower:
+            print(f"p95 latency regressed more than {args.max_regression:.0f}% for: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+    Creates a benchmark database with many users and large watchlists.
+    Every user can log in as bench{n}@example.com with BENCH_PASSWORD.
+    Usage: python bench/seed_db.py bench.db [--users 1000] [--watchlist 50] [--movies 5000] [--seed 1]
+"""
+import argparse, os, random, sqlite3, sys, time
+
+# Let the bench import app modules when run from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Meets PASSWORD_PATTERN so the login form accepts it
+BENCH_PASSWORD = "Bench123!"
+
+
+def bench_email(n):
+    """Returns the login email of the nth benchmark user"""
+    return f"bench{n}@example.com"
+
+
+def seed(path, users=1000, watchlist=50, movies=5000, seed=1):
+    """
+        Creates the app tables in a new database at path and fills them.
+        Must run before the app modules are imported in this process.
+        Parameters:
+        - path (str): database file, replaced if it exists
+        - users (int): number of users
+        - watchlist (int): saved movies per user
+        - movies (int): saved movies are picked from ids 1 to movies
+        - seed (int): random seed, the same seed gives the same database
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    # The app reads the database path when its modules are first imported
+    os.environ["DATABASE_NAME"] = path
+    from external_variables import PASSWORD_HASH_METHOD
+    from helpers import create_tables
+    from werkzeug.security import generate_password_hash
+    create_tables()
+
+    conn = sqlite3.connect(path)
+    rng = random.Random(seed)
+    # One hash shared by every user, hashing each would take minutes
+    pw_hash = generate_password_hash(BENCH_PASSWORD, method=PASSWORD_HASH_METHOD, salt_length=16)
+    conn.executemany("INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)",
+        ((n, f"bench{n}", bench_email(n), pw_hash) for n in range(1, users + 1)))
+    conn.executemany("INSERT INTO user_movies (user_id, movie_id) VALUES (?, ?)",
+        ((n, movie_id) for n in range(1, users + 1) for movie_id in rng.sample(range(1, movies + 1), min(watchlist, movies))))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--watchlist", type=int, default=50)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.path, args.users, args.watchlist, args.movies, args.seed)
+    print(f"Seeded {args.users} users with {args.watchlist} saved movies each in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
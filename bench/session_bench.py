@@ -0,0 +1,78 @@
+"""
+    Compares the SQLite session store against the Flask-Session filesystem store.
+    Fills each store with live sessions, then times random reads and writes.
+    Usage: python bench/session_bench.py [--sessions 100000] [--ops 5000]
+"""
+from datetime import timedelta
+import argparse, os, random, shutil, sys, tempfile, time, warnings
+
+# Let the bench import app modules when run from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, pct):
+    """Returns the pct percentile of a sorted list of samples"""
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def time_ops(label, op, keys, ops):
+    """Runs op on random keys and prints throughput and latency percentiles"""
+    samples = []
+    start = time.perf_counter()
+    for _ in range(ops):
+        key = random.choice(keys)
+        op_start = time.perf_counter()
+        op(key)
+        samples.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    print(f"  {label:<6} {ops / elapsed:>10.0f} ops/s   p50 {percentile(samples, 50) * 1e6:>8.0f}us   "
+          f"p95 {percentile(samples, 95) * 1e6:>8.0f}us   p99 {percentile(samples, 99) * 1e6:>8.0f}us")
+
+
+def bench_store(name, interface, app, sessions, ops):
+    """Fills a session store and times reads, updates and expired session cleanup"""
+    lifetime = timedelta(days=30)
+    keys = [f"session:{n}" for n in range(sessions)]
+    with app.app_context():
+        print(f"{name}: filling {sessions} sessions")
+        start = time.perf_counter()
+        for n, key in enumerate(keys):
+            data = interface.session_class({"user_id": n, "username": f"user{n}"}, sid=key)
+            interface._upsert_session(lifetime, data, key)
+        print(f"  fill   {sessions / (time.perf_counter() - start):>10.0f} ops/s")
+
+        time_ops("read", interface._retrieve_session_data, keys, ops)
+        time_ops("write", lambda key: interface._upsert_session(
+            lifetime, interface.session_class({"user_id": 1, "_flashes": [("success", "Saved")]}, sid=key), key), keys, ops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--ops", type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="session-bench-")
+    os.environ["DATABASE_NAME"] = os.path.join(workdir, "bench.db")
+    try:
+        from flask import Flask
+        from helpers import create_tables
+        from sqlite_session import SqliteSessionInterface
+
+        app = Flask(__name__)
+        create_tables()
+        bench_store("sqlite", SqliteSessionInterface(app, sweep_interval=0), app, args.sessions, args.ops)
+
+        # Threshold 0 so the filesystem store can hold every session instead of pruning at 500
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            from flask_session.filesystem import FileSystemSessionInterface
+            filesystem = FileSystemSessionInterface(app, cache_dir=os.path.join(workdir, "flask_session"), threshold=0)
+        bench_store("filesystem", filesystem, app, args.sessions, args.ops)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+    Local stand-in for the TMDB api endpoints the app calls, for benchmarks.
+    Movie, release date, credits, search, image and daily export responses are generated
+    from the id or query so every run sees the same data. Each response can
+    be delayed and a share of them answered with an error.
+    Usage: python bench/tmdb_stub.py [--port 8800] [--latency 50] [--jitter 20] [--error-rate 0.01]
+    Point the app at it with TMDB_BASE_URL=http://127.0.0.1:8800/3 and
+    TMDB_IMAGE_BASE_URL=http://127.0.0.1:8800/t/p
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse, gzip, json, random, threading, time
+
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Romance", "Science Fiction", "Thriller"]
+WORDS = ["night", "star", "river", "ghost", "city", "summer", "iron", "last", "secret", "wild", "blue", "king"]
+SEARCH_PAGES = 5
+
+
+def movie_title(id):
+    """Returns a made up title that is the same for every call with the id"""
+    rng = random.Random(id)
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title() + f" {id}"
+
+
+def movie_details(id):
+    """Returns a /movie/{id} payload"""
+    rng = random.Random(id)
+    return {
+        "id": id,
+        "title": movie_title(id),
+        "original_title": movie_title(id),
+        "release_date": f"{rng.randint(1950, 2024)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+        "runtime": rng.randint(80, 180),
+        "genres": [{"id": n, "name": name} for n, name in enumerate(rng.sample(GENRES, 2))],
+        "vote_average": round(rng.uniform(3, 9), 1),
+        "vote_count": rng.randint(0, 20000),
+        "popularity": round(rng.uniform(0, 500), 3),
+        "poster_path": f"/poster{id}.jpg",
+        "tagline": "A benchmark movie.",
+        "overview": "Lorem ipsum dolor sit amet. " * rng.randint(5, 20),
+        # Fields the app skips while decoding, real responses carry plenty of them
+        "belongs_to_collection": None,
+        "production_companies": [{"id": n, "name": f"Studio {n}", "origin_country": "US"} for n in range(5)],
+        "spoken_languages": [{"english_name": "English", "iso_639_1": "en", "name": "English"}],
+    }
+
+
+def release_dates(id):
+    """Returns a /movie/{id}/release_dates payload"""
+    return {"id": id, "results": [
+        {"iso_3166_1": country, "release_dates": [{"certification": "PG-13", "release_date": "2001-02-03T00:00:00.000Z", "type": 3}]}
+        for country in ("GB", "DE", "US", "FR")
+    ]}
+
+
+def credits(id):
+    """Returns a /movie/{id}/credits payload with a large crew like real responses"""
+    return {
+        "id": id,
+        "cast": [{"name": f"Actor {id}-{n}", "character": f"Role {n}", "profile_path": f"/profile{n}.jpg"} for n in range(40)],
+        "crew": [{"name": f"Director {id}", "job": "Director"}] + [{"name": f"Crew {n}", "job": "Grip"} for n in range(150)],
+    }
+
+
+def search(query, page):
+    """Returns a /search/movie payload"""
+    start = (sum(map(ord, query)) * 37 + page * 20) % 900000
+    results = []
+    for id in range(start, start + 20):
+        movie = movie_details(id)
+        movie["original_title"] = f"{query.title()} {movie['original_title']}"
+        results.append(movie)
+    return {"page": page, "results": results, "total_pages": SEARCH_PAGES, "total_results": SEARCH_PAGES * 20}
+
+
+def movie_ids_export(count):
+    """Returns a gzipped daily movie id export listing ids 1 to count"""
+    lines = (json.dumps({"adult": False, "id": id, "original_title": movie_title(id), "popularity": movie_details(id)["popularity"], "video": False})
+             for id in range(1, count + 1))
+    return gzip.compress(("\n".join(lines) + "\n").encode())
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # One write per response, keep-alive connections would otherwise wait on delayed acks
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    export_movies = 5000
+    counts = {"requests": 0, "errors": 0}
+    counts_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if url.path == "/stats":
+            return self.send_json(200, self.counts)
+
+        delay = max(self.latency + random.uniform(-self.jitter, self.jitter), 0)
+        time.sleep(delay)
+        with self.counts_lock:
+            self.counts["requests"] += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.counts["errors"] += 1
+        if failed:
+            return self.send_json(random.choice((429, 500, 503)), {"success": False, "status_message": "Injected error"})
+
+        if parts[:2] == ["p", "exports"]:
+            # Daily exports are /p/exports/movie_ids_{MM_DD_YYYY}.json.gz
+            return self.send_body(200, movie_ids_export(self.export_movies), "application/octet-stream")
+        if parts[:1] == ["t"]:
+            # Image paths are /t/p/{size}/{name}
+            return self.send_body(200, b"\xff\xd8\xff" + bytes(8000), "image/jpeg")
+        if parts[:3] == ["3", "search", "movie"]:
+            page = int(query.get("page", ["1"])[0])
+            return self.send_json(200, search(query.get("query", [""])[0], page))
+        if parts[:2] == ["3", "movie"] and len(parts) >= 3 and parts[2].isdigit():
+            id = int(parts[2])
+            if len(parts) == 3:
+                body = movie_details(id)
+                appended = query.get("append_to_response", [""])[0].split(",")
+                if "release_dates" in appended:
+                    body["release_dates"] = {"results": release_dates(id)["results"]}
+                if "credits" in appended:
+                    body["credits"] = {key: value for key, value in credits(id).items() if key != "id"}
+                return self.send_json(200, body)
+            if parts[3] == "release_dates":
+                return self.send_json(200, release_dates(id))
+            if parts[3] == "credits":
+                return self.send_json(200, credits(id))
+        self.send_json(404, {"success": False, "status_message": "The resource you requested could not be found."})
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(body).encode(), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    # Room for every benchmark client to connect at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_stub(port=0, latency=0.05, jitter=0.0, error_rate=0.0, export_movies=5000):
+    """Starts the stub on a daemon thread, returns the server. Port 0 picks a free port."""
+    handler = type("Handler", (StubHandler,), {
+        "latency": latency, "jitter": jitter, "error_rate": error_rate, "export_movies": export_movies,
+        "counts": {"requests": 0, "errors": 0}, "counts_lock": threading.Lock(),
+    })
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, name="tmdb-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="random milliseconds added or taken off the latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of responses answered with a 429 or 5xx")
+    parser.add_argument("--export-movies", type=int, default=5000, help="movie ids listed in the daily export")
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency / 1000, args.jitter / 1000, args.error_rate, args.export_movies)
+    print(f"TMDB stub listening on http://127.0.0.1:{server.server_port}/3")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
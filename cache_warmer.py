@@ -0,0 +1,194 @@
+from external_variables import CACHE_WARMER_BUDGET, CACHE_WARMER_INTERVAL, CACHE_WARMER_LEAD, CACHE_WARMER_TOP_MOVIES, SINGLE_FLIGHT_LOCK_DIR, TMDB_APPEND_TO_RESPONSE, TMDB_CACHE_TTL
+from helpers import MOVIE_NOT_FOUND, get_db_connection, request_movie_details, request_payload
+from metrics import WARMED_PAYLOADS, WARMER_DUE
+from single_flight import single_flight
+from tmdb import TMDB_ERRORS, tmdb_breaker
+import os, threading, time
+
+# The lock file that keeps the cache warmer to one worker process per host is only available on Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Movie ids looked up in tmdb_cache at once
+DUE_BATCH_SIZE = 500
+
+# Movies refreshed between progress reports
+PROGRESS_INTERVAL = 25
+
+def most_saved_movies(limit=CACHE_WARMER_TOP_MOVIES):
+    """Returns the ids of the movies on the most watchlists, most saved first"""
+    rows = get_db_connection().execute("""
+        SELECT movie_id FROM user_movies
+        GROUP BY movie_id
+        ORDER BY COUNT(*) DESC, movie_id
+        LIMIT ?
+    """, (limit,))
+    return [row[0] for row in rows]
+
+
+def due_payloads(movie_ids, lead=CACHE_WARMER_LEAD):
+    """
+        Returns {movie id: [payload types]} for the cached payloads of each movie
+        that are missing or go stale within lead seconds, in the order of movie_ids
+    """
+    conn = get_db_connection()
+    fetched = {}
+    for start in range(0, len(movie_ids), DUE_BATCH_SIZE):
+        batch = movie_ids[start:start + DUE_BATCH_SIZE]
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(f"SELECT movie_id, payload_type, fetched_at FROM tmdb_cache WHERE movie_id IN ({placeholders})", batch)
+        for movie_id, payload_type, fetched_at in rows:
+            fetched[movie_id, payload_type] = fetched_at
+
+    refresh_before = time.time() + lead
+    due = {}
+    for movie_id in movie_ids:
+        payload_types = [payload_type for payload_type, ttl in TMDB_CACHE_TTL.items()
+                         if (movie_id, payload_type) not in fetched or fetched[movie_id, payload_type] + ttl <= refresh_before]
+        if payload_types:
+            due[movie_id] = payload_types
+    return due
+
+
+def missing_movies():
+    """Returns {movie id: time to try it again} for the movies TMDB answered 404 for"""
+    return dict(get_db_connection().execute("SELECT movie_id, retry_at FROM missing_movies").fetchall())
+
+
+def warm_cache(budget=CACHE_WARMER_BUDGET, top=CACHE_WARMER_TOP_MOVIES, lead=CACHE_WARMER_LEAD, on_progress=None):
+    """
+        Refreshes the cached TMDB payloads of the most saved movies before they go stale,
+        most saved first, so homepage and movie page requests are served from the cache.
+        Stops once budget TMDB calls were made or the TMDB circuit breaker opens.
+        Movies TMDB answered 404 for are skipped until their backoff runs out.
+        Returns a dict with the payloads that were due, refreshed, failed and found
+        missing, the calls made and the payloads still due when the run stopped.
+        Parameters:
+        - budget (int): most TMDB calls to make
+        - top (int): number of most saved movies to keep warm
+        - lead (float): seconds before going stale that a payload is refreshed
+        - on_progress (callable): called with the stats dict every PROGRESS_INTERVAL movies
+    """
+    missing = missing_movies()
+    now = time.time()
+    due = due_payloads([movie_id for movie_id in most_saved_movies(top) if missing.get(movie_id, 0) <= now], lead)
+    stats = {"due": sum(len(payload_types) for payload_types in due.values()), "refreshed": 0, "failed": 0, "missing": 0, "calls": 0, "remaining": 0}
+    movies = 0
+    for movie_id, payload_types in due.items():
+        if stats["calls"] >= budget or tmdb_breaker.is_open():
+            stats["remaining"] += len(payload_types)
+            continue
+        refresh_movie(movie_id, payload_types, budget, stats)
+        movies += 1
+        if on_progress and movies % PROGRESS_INTERVAL == 0:
+            on_progress(stats)
+
+    WARMER_DUE.set(stats["remaining"])
+    return stats
+
+
+def refresh_movie(movie_id, payload_types, budget, stats):
+    """
+        Refetches the due payload types of a movie, with the combined call when more than one is due.
+        Shares the call with any request fetching the same payloads at the same time, but skips their
+        recheck, since a payload that is about to go stale still counts as fresh there.
+        When TMDB answers 404 the movie's other payloads aren't fetched, see record_missing.
+        Adds the payloads it refreshed, failed to refresh or found missing and the calls it made to stats.
+    """
+    if TMDB_APPEND_TO_RESPONSE and len(payload_types) > 1:
+        stats["calls"] += 1
+        try:
+            details = single_flight.do(f"movie_details:{movie_id}", lambda: request_movie_details(movie_id))
+        except TMDB_ERRORS:
+            record_refresh(stats, "failed", len(payload_types))
+            return
+        if details == MOVIE_NOT_FOUND:
+            record_refresh(stats, "missing", len(payload_types))
+            return
+        if details:
+            record_refresh(stats, "refreshed", len(payload_types))
+            return
+        # The combined call couldn't be used, make one call per payload
+
+    for index, payload_type in enumerate(payload_types):
+        if stats["calls"] >= budget:
+            stats["remaining"] += len(payload_types) - index
+            return
+        stats["calls"] += 1
+        statuses = []
+        try:
+            payload = single_flight.do(f"payload:{movie_id}:{payload_type}", lambda: request_payload(movie_id, payload_type, statuses))
+        except TMDB_ERRORS:
+            payload = None
+        if payload is None and 404 in statuses:
+            record_refresh(stats, "missing", len(payload_types) - index)
+            return
+        record_refresh(stats, "refreshed" if payload else "failed")
+
+
+def record_refresh(stats, outcome, count=1):
+    """Adds count payloads with the outcome, refreshed, failed or missing, to stats and the warmer metrics"""
+    stats[outcome] += count
+    for _ in range(count):
+        WARMED_PAYLOADS.inc(outcome)
+
+
+class CacheWarmer:
+    """
+        Background thread that runs warm_cache every interval seconds, starting right away so
+        a deploy doesn't leave the first homepage visits to fill the cache. The app starts it
+        with the first request a process handles. When several worker processes run one,
+        a lock file lets only one of them warm the cache at a time.
+    """
+
+    def __init__(self, app, interval=CACHE_WARMER_INTERVAL, lock_dir=SINGLE_FLIGHT_LOCK_DIR):
+        self.app = app
+        self.interval = interval
+        self.lock_path = os.path.join(lock_dir, "cache-warmer.lock")
+
+    def start(self):
+        """Starts the warmer on a daemon thread"""
+        threading.Thread(target=self.run_forever, name="cache-warmer", daemon=True).start()
+
+    def run_forever(self):
+        """Warms the cache, then waits for the next run"""
+        with self.app.app_context():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Error warming the TMDB cache: {e}")
+                time.sleep(self.interval)
+
+    def run_once(self):
+        """Runs warm_cache unless another process is running it, returns its stats or None"""
+        lock = self._lock()
+        if lock is False:
+            return None
+        try:
+            start = time.perf_counter()
+            stats = warm_cache()
+            print(f"Cache warmer refreshed {stats['refreshed']} payloads with {stats['calls']} TMDB calls in "
+                  f"{time.perf_counter() - start:.1f}s, {stats['failed']} failed, {stats['missing']} missing on TMDB, {stats['remaining']} still due")
+            return stats
+        finally:
+            if lock is not None:
+                os.close(lock)
+
+    def _lock(self):
+        """Takes the warmer lock file, returns it, None if lock files can't be used or False if another process holds it"""
+        if fcntl is None:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock)
+            return False
+        return lock
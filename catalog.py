@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from external_variables import CATALOG_BATCH_SIZE, TMDB_CONNECT_TIMEOUT, TMDB_EXPORT_URL, TMDB_READ_TIMEOUT
+from helpers import get_db_connection
+from models import catalog_entry_decoder
+import gzip, itertools, msgspec, requests, time
+
+UPSERT_CATALOG_MOVIE = """
+    INSERT INTO catalog_movies (id, original_title, popularity, adult, video) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        original_title = excluded.original_title,
+        popularity = excluded.popularity,
+        adult = excluded.adult,
+        video = excluded.video
+"""
+
+
+def export_url(date=None):
+    """
+        Returns the url of TMDB's movie id export for a date.
+        Parameters:
+        - date (date): export date, defaults to yesterday in UTC since today's may not be published yet
+    """
+    date = date or (datetime.now(timezone.utc) - timedelta(days=1)).date()
+    return TMDB_EXPORT_URL.format(date=date.strftime("%m_%d_%Y"))
+
+
+@contextmanager
+def open_export(source):
+    """Opens a gzipped export from a url or a local file, yields a binary file of the decompressed lines"""
+    if source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True, timeout=(TMDB_CONNECT_TIMEOUT, TMDB_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            # Decompressed as it downloads, the whole export is never held in memory
+            with gzip.GzipFile(fileobj=response.raw, mode="rb") as export:
+                yield export
+    else:
+        with gzip.open(source, "rb") as export:
+            yield export
+
+
+def ingest_catalog(source, batch_size=CATALOG_BATCH_SIZE, restart=False, on_progress=None):
+    """
+        Loads a TMDB movie id export into the movie catalog, one transaction per batch of lines.
+        The number of lines loaded is committed with each batch, so running it again for the
+        same source skips them and carries on. A source that was loaded completely is skipped.
+        Returns (lines, invalid), the lines loaded by this run and how many of them couldn't be decoded.
+        Parameters:
+        - source (str): url or path of a gzipped json lines export
+        - batch_size (int): lines written in each transaction
+        - restart (bool): load the source from the start even if it was loaded before
+        - on_progress (callable): called with the total lines loaded from the source after each batch
+    """
+    conn = get_db_connection()
+    row = conn.execute("SELECT lines_done, finished_at FROM catalog_imports WHERE source = ?", (source,)).fetchone()
+    if row is not None and row[1] is not None and not restart:
+        return 0, 0
+    if row is None or restart:
+        conn.execute("INSERT OR REPLACE INTO catalog_imports (source, lines_done, started_at) VALUES (?, 0, ?)", (source, time.time()))
+        conn.commit()
+        lines_done = 0
+    else:
+        lines_done = row[0]
+
+    lines = invalid = 0
+    with open_export(source) as export:
+        # Lines loaded by an earlier run still have to be read past, the export can't be seeked
+        for _ in itertools.islice(export, lines_done):
+            pass
+        while batch := list(itertools.islice(export, batch_size)):
+            rows = []
+            for line in batch:
+                if not line.strip():
+                    continue
+                try:
+                    entry = catalog_entry_decoder.decode(line)
+                except msgspec.DecodeError:
+                    invalid += 1
+                    continue
+                rows.append((entry.id, entry.original_title, entry.popularity, entry.adult, entry.video))
+            lines_done += len(batch)
+            lines += len(batch)
+            conn.executemany(UPSERT_CATALOG_MOVIE, rows)
+            conn.execute("UPDATE catalog_imports SET lines_done = ? WHERE source = ?", (lines_done, source))
+            conn.commit()
+            if on_progress:
+                on_progress(lines_done)
+
+    conn.execute("UPDATE catalog_imports SET finished_at = ? WHERE source = ?", (time.time(), source))
+    conn.commit()
+    return lines, invalid
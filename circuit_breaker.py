@@ -0,0 +1,78 @@
+from external_variables import TMDB_BREAKER_FAILURES, TMDB_BREAKER_RESET, TMDB_BREAKER_SLOW_CALL
+from metrics import BREAKER_REJECTED, BREAKER_STATE
+import threading, time
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+        Stops calling an upstream that keeps failing or answering slowly.
+        While closed every call is made, and a call that fails or takes longer
+        than slow_call seconds counts as a failure. After failures of them in a
+        row it opens and calls raise CircuitOpenError without being made.
+        After reset seconds it is half open and lets one trial call through,
+        which closes it again if it succeeds or reopens it if it fails.
+    """
+
+    # Breaker state values in the state gauge
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name, failures=TMDB_BREAKER_FAILURES, slow_call=TMDB_BREAKER_SLOW_CALL, reset=TMDB_BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.slow_call = slow_call
+        self.reset = reset
+        self.state = "closed"
+        self._failed = 0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, name)
+
+    def check(self):
+        """
+            Raises CircuitOpenError while calls are refused, without letting a trial call through.
+            Lets callers give up before waiting on a queue or on a call another caller already made.
+        """
+        if self.is_open():
+            BREAKER_REJECTED.inc(self.name)
+            raise CircuitOpenError(f"{self.name} circuit breaker is {self.state}")
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            # Open long enough, or the last trial call never reported back, let a trial call through
+            if time.monotonic() - self._changed_at >= self.reset:
+                self._set_state("half_open")
+                return
+        BREAKER_REJECTED.inc(self.name)
+        raise CircuitOpenError(f"{self.name} circuit breaker is {self.state}")
+
+    def after_call(self, elapsed, failed):
+        """Records how a call went, failed calls and calls slower than slow_call count against the upstream"""
+        failed = failed or elapsed >= self.slow_call
+        with self._lock:
+            if not failed:
+                self._failed = 0
+                if self.state == "half_open":
+                    self._set_state("closed")
+                return
+            self._failed += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failed >= self.failures):
+                self._set_state("open")
+
+    def is_open(self):
+        """Returns if calls are being refused, false once a trial call is due"""
+        with self._lock:
+            return self.state != "closed" and time.monotonic() - self._changed_at < self.reset
+
+    def _set_state(self, state):
+        """Moves to state, called with the lock held"""
+        if state != self.state:
+            print(f"{self.name} circuit breaker {state}")
+        self.state = state
+        self._changed_at = time.monotonic()
+        BREAKER_STATE.set(self.STATES[state], self.name)
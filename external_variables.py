@@ -1,5 +1,5 @@
 from dotenv import load_dotenv
-import os, re
+import os, re, tempfile
 
 load_dotenv()
 
@@ -16,15 +16,201 @@ PASSWORD_PATTERN = re.compile(
 # Database name from environment variable
 DATABASE = os.getenv("DATABASE_NAME")
 
+# Milliseconds a query waits on a locked database before failing
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))
+
+# Page cache size in KiB and prepared statements cached per database connection
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", 16 * 1024))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
+
 # API key from environment variable
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 
+# Base url for every TMDB api call
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+
+# Number of keep-alive connections each worker keeps open to TMDB
+TMDB_POOL_SIZE = int(os.getenv("TMDB_POOL_SIZE", 10))
+
+# Seconds a call waits for a free pooled TMDB connection before failing
+TMDB_POOL_TIMEOUT = float(os.getenv("TMDB_POOL_TIMEOUT", 5))
+
+# Seconds to wait for a TMDB connection and for its response
+TMDB_CONNECT_TIMEOUT = float(os.getenv("TMDB_CONNECT_TIMEOUT", 3.05))
+TMDB_READ_TIMEOUT = float(os.getenv("TMDB_READ_TIMEOUT", 10))
+
+# Retries for TMDB calls that fail with a 429 or 5xx status
+TMDB_RETRIES = int(os.getenv("TMDB_RETRIES", 3))
+TMDB_BACKOFF = float(os.getenv("TMDB_BACKOFF", 0.3))
+TMDB_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Longest wait before a retry that a Retry-After header from TMDB is followed for
+TMDB_MAX_RETRY_AFTER = float(os.getenv("TMDB_MAX_RETRY_AFTER", 5))
+
+# Seconds to wait for the response of each TMDB endpoint, other endpoints use TMDB_READ_TIMEOUT.
+# Search results are shown while the user types, so search gives up sooner
+TMDB_ENDPOINT_TIMEOUTS = {
+    "search": float(os.getenv("TMDB_TIMEOUT_SEARCH", 3)),
+    "movie_details": float(os.getenv("TMDB_TIMEOUT_MOVIE_DETAILS", 5)),
+    "movie": float(os.getenv("TMDB_TIMEOUT_MOVIE", 5)),
+    "release_dates": float(os.getenv("TMDB_TIMEOUT_RELEASE_DATES", 5)),
+    "credits": float(os.getenv("TMDB_TIMEOUT_CREDITS", 5)),
+    "poster": float(os.getenv("TMDB_TIMEOUT_POSTER", 5)),
+}
+
+# Failed or slow TMDB calls in a row that open the circuit breaker, seconds after which
+# a call counts as slow, and seconds TMDB isn't called for once it is open
+TMDB_BREAKER_FAILURES = int(os.getenv("TMDB_BREAKER_FAILURES", 5))
+TMDB_BREAKER_SLOW_CALL = float(os.getenv("TMDB_BREAKER_SLOW_CALL", 4))
+TMDB_BREAKER_RESET = float(os.getenv("TMDB_BREAKER_RESET", 30))
+
+# Most TMDB calls the async client has in flight at once, shared by every async view
+TMDB_ASYNC_MAX_CONNECTIONS = int(os.getenv("TMDB_ASYNC_MAX_CONNECTIONS", 100))
+
+# Serve the homepage, movie page and search results with the async views
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "false").lower() == "true"
+
+# Directory for the lock files that let worker processes on one host share a
+# TMDB fetch, and how many lock files keys are spread over
+SINGLE_FLIGHT_LOCK_DIR = os.getenv("SINGLE_FLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "movie-list-locks"))
+SINGLE_FLIGHT_LOCK_STRIPES = int(os.getenv("SINGLE_FLIGHT_LOCK_STRIPES", 256))
+
+# Fetch details, release dates and credits in one call using append_to_response
+TMDB_APPEND_TO_RESPONSE = os.getenv("TMDB_APPEND_TO_RESPONSE", "true").lower() == "true"
+
+# Seconds each type of cached TMDB payload is fresh for, stale payloads
+# are still served while they are refreshed in the background
+TMDB_CACHE_TTL = {
+    "details": int(os.getenv("TMDB_CACHE_TTL_DETAILS", 60 * 60 * 24)),
+    "release_dates": int(os.getenv("TMDB_CACHE_TTL_RELEASE_DATES", 60 * 60 * 24 * 7)),
+    "credits": int(os.getenv("TMDB_CACHE_TTL_CREDITS", 60 * 60 * 24 * 7)),
+}
+
+# Version of format_movie_info output, bump it when the formatter changes
+# so stored movie page info is rebuilt
+MOVIE_VIEW_VERSION = 2
+
+# Size limit in bytes and seconds to keep entries for the in-memory search cache
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 60 * 10))
+
+# Fewest local title index matches needed to answer a search without TMDB
+SEARCH_LOCAL_MIN_RESULTS = int(os.getenv("SEARCH_LOCAL_MIN_RESULTS", 5))
+
+# Most upstream pages a streamed search response will fetch
+SEARCH_STREAM_MAX_PAGES = int(os.getenv("SEARCH_STREAM_MAX_PAGES", 5))
+
+# Smallest response body in bytes worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+
+# Origin for TMDB poster and profile images
+TMDB_IMAGE_BASE_URL = os.getenv("TMDB_IMAGE_BASE_URL", "https://image.tmdb.org/t/p")
+
+# Image sizes the poster endpoint serves
+POSTER_SIZES = ("w92", "w300_and_h450_bestv2", "w138_and_h175_face")
+
+# Directory and size budget in bytes for cached poster images
+POSTER_CACHE_DIR = os.getenv("POSTER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "poster_cache"))
+POSTER_CACHE_MAX_BYTES = int(os.getenv("POSTER_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Let the web server send poster files itself with X-Sendfile
+USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
+
+# Most TMDB calls a single homepage request can have in flight at once
+WATCHLIST_MAX_CONCURRENCY = int(os.getenv("WATCHLIST_MAX_CONCURRENCY", 8))
+
+# Seconds the homepage waits for watchlist movies before showing placeholders
+WATCHLIST_DEADLINE = float(os.getenv("WATCHLIST_DEADLINE", 4))
+
+# Saved movies shown on each page of the homepage
+WATCHLIST_PAGE_SIZE = int(os.getenv("WATCHLIST_PAGE_SIZE", 20))
+
+# Most movie ids one bulk watchlist request can add or remove
+WATCHLIST_BULK_MAX_IDS = int(os.getenv("WATCHLIST_BULK_MAX_IDS", 10000))
+
+# Rows written or read at once by bulk saves, imports and exports
+WATCHLIST_BATCH_SIZE = int(os.getenv("WATCHLIST_BATCH_SIZE", 500))
+
+# Time requests, database queries, TMDB calls and template rendering
+# for the Server-Timing header and the /metrics endpoint
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Upper bounds in seconds of the latency histogram buckets
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
 # String for error for not matching password requirements
 PASSWORD_ERR = "Password must be at least 7 characters and contain at least one uppercase letter, digit, and special character(@$!%*?&)."
 
+# pbkdf2 iterations for new password hashes, older hashes are upgraded on login
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", 600000))
+PASSWORD_HASH_METHOD = f"pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}"
+
+# Worker processes for password hashing, and hashing jobs allowed in the queue at once
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 2))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", 32))
+
+# Seconds a request waits for a free hashing queue slot before giving up
+HASH_QUEUE_TIMEOUT = float(os.getenv("HASH_QUEUE_TIMEOUT", 5))
+
+# String for error when the password hashing queue is full
+HASH_BUSY_ERR = "The server is busy right now. Please try again in a moment."
+
 # Global variable for setting flash message key
 FLASH_KEY = "flash_key" 
 
+# Seconds between background sweeps that delete expired sessions
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", 60 * 5))
+
+# Seconds before an unchanged session has its expiry pushed back
+SESSION_REFRESH_INTERVAL = int(os.getenv("SESSION_REFRESH_INTERVAL", 60 * 60))
+
+# Seconds a session holding only a flash message is kept for
+FLASH_SESSION_LIFETIME = int(os.getenv("FLASH_SESSION_LIFETIME", 60 * 5))
+
+# Outgoing mail server, point at a local SMTP server for testing
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+MAIL_USE_TLS = os.getenv("MAIL_USE_TLS", "true").lower() == "true"
+
+# Start the background worker that sends emails from the outbox
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "true").lower() == "true"
+
+# Seconds between outbox checks when no email was queued in this process
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 5))
+
+# Emails claimed by the worker at once
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 20))
+
+# Delivery attempts before an email is marked failed, and the first retry delay in seconds
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", 30))
+
+# Seconds before an email left sending by a stopped worker is sent again
+OUTBOX_CLAIM_TIMEOUT = int(os.getenv("OUTBOX_CLAIM_TIMEOUT", 60 * 5))
+
+# TMDB daily export of every movie id, {date} is replaced with the export's MM_DD_YYYY date
+TMDB_EXPORT_URL = os.getenv("TMDB_EXPORT_URL", "http://files.tmdb.org/p/exports/movie_ids_{date}.json.gz")
+
+# Export lines written to the movie catalog in each transaction by ingest-catalog
+CATALOG_BATCH_SIZE = int(os.getenv("CATALOG_BATCH_SIZE", 10000))
+
+# Refresh the cached TMDB payloads of the most saved movies in the background
+CACHE_WARMER = os.getenv("CACHE_WARMER", "true").lower() == "true"
+
+# Seconds between cache warmer runs, and most TMDB calls one run makes
+CACHE_WARMER_INTERVAL = float(os.getenv("CACHE_WARMER_INTERVAL", 60 * 15))
+CACHE_WARMER_BUDGET = int(os.getenv("CACHE_WARMER_BUDGET", 200))
+
+# Most saved movies the cache warmer keeps warm
+CACHE_WARMER_TOP_MOVIES = int(os.getenv("CACHE_WARMER_TOP_MOVIES", 1000))
+
+# Seconds before a cached payload goes stale that the cache warmer refreshes it,
+# at least CACHE_WARMER_INTERVAL so a payload never goes stale between runs
+CACHE_WARMER_LEAD = float(os.getenv("CACHE_WARMER_LEAD", 60 * 60))
+
+# Seconds a movie TMDB answered 404 for is skipped by saves, the homepage and the cache warmer, doubled with every 404 in a row
+CACHE_WARMER_MISSING_BACKOFF = float(os.getenv("CACHE_WARMER_MISSING_BACKOFF", 60 * 60 * 24))
+
 ################## Form Fields Start ##################
 username_field = {
     "name": "username",
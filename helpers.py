@@ -1,17 +1,84 @@
-from external_variables import DATABASE, EMAIL_PATTERN, ENTRY_FORM_FIELDS, FLASH_KEY, TMDB_API_KEY, PASSWORD_ERR, PASSWORD_PATTERN
-from flask import flash, get_flashed_messages, jsonify, session
-from werkzeug.security import check_password_hash, generate_password_hash
-import requests, sqlite3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from external_variables import CACHE_WARMER_MISSING_BACKOFF, COMPRESS_MIN_BYTES, DATABASE, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_STATEMENT_CACHE_SIZE, EMAIL_PATTERN, ENTRY_FORM_FIELDS, FLASH_KEY, HASH_BUSY_ERR, METRICS_ENABLED, MOVIE_VIEW_VERSION, PASSWORD_ERR, PASSWORD_PATTERN, SEARCH_CACHE_MAX_BYTES, SEARCH_CACHE_TTL, SEARCH_LOCAL_MIN_RESULTS, SEARCH_STREAM_MAX_PAGES, TMDB_APPEND_TO_RESPONSE, TMDB_CACHE_TTL, TMDB_POOL_SIZE, WATCHLIST_BATCH_SIZE, WATCHLIST_DEADLINE, WATCHLIST_MAX_CONCURRENCY, WATCHLIST_PAGE_SIZE
+from flask import Response, flash, g, get_flashed_messages, has_app_context, request, session
+from memory_cache import ByteLRUCache
+from metrics import MEMORY_CACHES, STEP_DURATION, TimedConnection, submit_timed, timed
+from models import CompactSearchPage, CompactSearchResult, Credits, MovieDetails, PartialCompactSearchPage, PartialSearchPage, ReleaseDates, SearchPage, SearchResult, decode_payload, details_with_append_decoder, encoder, movie_view_decoder, search_page_decoder, split_details_with_append
+from passwords import HashQueueFull, hash_password, needs_rehash, verify_password
+from single_flight import single_flight
+from tmdb import TMDB_ERRORS, tmdb_breaker, tmdb_client
+import codecs, csv, gzip, hashlib, io, itertools, json, math, msgspec, os, requests, sqlite3, tempfile, threading, time, unicodedata
 
-def get_db_connection():
+# Brotli is optional, responses are gzipped when it is not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Worker threads for running TMDB calls concurrently
+tmdb_executor = ThreadPoolExecutor(max_workers=TMDB_POOL_SIZE, thread_name_prefix="tmdb")
+
+# Movie ids with a background cache refresh already queued in this process
+refreshing_movies = set()
+refreshing_lock = threading.Lock()
+
+# Database connections for threads running outside of a request
+thread_connections = threading.local()
+
+# Search responses keyed by normalized query
+search_cache = ByteLRUCache(SEARCH_CACHE_MAX_BYTES, SEARCH_CACHE_TTL)
+MEMORY_CACHES.register("search", search_cache)
+
+# Digest of the page templates, part of every page ETag so a template change
+# is never answered with 304 for a page rendered by the old template
+templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+template_digest = hashlib.blake2b(digest_size=8)
+for name in sorted(os.listdir(templates_dir)):
+    with open(os.path.join(templates_dir, name), "rb") as template:
+        template_digest.update(template.read())
+TEMPLATE_VERSION = template_digest.hexdigest()
+
+
+def connect_db():
     """
-        Establish connection for database.
-        Making the connection visible in multiple threads.
+        Opens a new database connection with WAL journaling,
+        a busy timeout and tuned cache pragmas
     """
-    conn = sqlite3.connect(DATABASE)
+    # An async view uses the request connection from its event loop thread,
+    # a connection is still only used by one thread at a time
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT / 1000, cached_statements=DB_STATEMENT_CACHE_SIZE, check_same_thread=False,
+        factory=TimedConnection if METRICS_ENABLED else sqlite3.Connection)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
 
+def get_db_connection():
+    """
+        Returns the database connection for the current request, opening it on first use.
+        Outside of a request, like on worker threads or cli commands,
+        each thread keeps its own connection open for reuse.
+    """
+    if has_app_context():
+        if "db" not in g:
+            g.db = connect_db()
+        return g.db
+    if not hasattr(thread_connections, "db"):
+        thread_connections.db = connect_db()
+    return thread_connections.db
+
+
+def close_db_connection(exception=None):
+    """Closes the request database connection, registered as an app context teardown"""
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
 def create_tables():
     """
         Creates a new database table for users, movies, and combined.
@@ -37,8 +104,218 @@ def create_tables():
         );
     """)
 
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tmdb_cache (
+            movie_id INTEGER NOT NULL,
+            payload_type TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (movie_id, payload_type)
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY NOT NULL,
+            data BLOB NOT NULL,
+            expiry REAL NOT NULL
+        ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry);")
+
+    # Emails waiting to be sent by the outbox worker
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS email_outbox_due ON email_outbox (status, next_attempt_at);")
+
+    # Bumped each time a user's watchlist changes, used for the homepage ETag
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS watchlist_versions (
+            user_id INTEGER PRIMARY KEY NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+    # Formatted movie page info, rebuilt when its payloads or MOVIE_VIEW_VERSION change
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS movie_views (
+            movie_id INTEGER PRIMARY KEY NOT NULL,
+            version INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            built_at REAL NOT NULL
+        );
+    """)
+
+    # Every movie the app has seen, used for the local search index
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS known_movies (
+            id INTEGER PRIMARY KEY NOT NULL,
+            title TEXT,
+            original_title TEXT,
+            release_date TEXT,
+            poster_path TEXT,
+            overview TEXT,
+            popularity REAL NOT NULL DEFAULT 0,
+            vote_count INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+    # Every movie id in TMDB's daily export, loaded by the ingest-catalog command
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_movies (
+            id INTEGER PRIMARY KEY NOT NULL,
+            original_title TEXT,
+            popularity REAL NOT NULL DEFAULT 0,
+            adult INTEGER NOT NULL DEFAULT 0,
+            video INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+    # Export lines loaded so far from each source, so an interrupted ingest resumes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_imports (
+            source TEXT PRIMARY KEY NOT NULL,
+            lines_done INTEGER NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL,
+            finished_at REAL
+        );
+    """)
+
+    # Movies TMDB answered 404 for, which are skipped until retry_at
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS missing_movies (
+            movie_id INTEGER PRIMARY KEY NOT NULL,
+            misses INTEGER NOT NULL DEFAULT 0,
+            retry_at REAL NOT NULL
+        );
+    """)
+
+    # Full text indexes over known_movies and catalog_movies titles, kept in sync by triggers
+    try:
+        cur.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(
+                title, original_title,
+                content='known_movies', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            CREATE TRIGGER IF NOT EXISTS known_movies_ai AFTER INSERT ON known_movies BEGIN
+                INSERT INTO movie_search (rowid, title, original_title) VALUES (new.id, new.title, new.original_title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS known_movies_ad AFTER DELETE ON known_movies BEGIN
+                INSERT INTO movie_search (movie_search, rowid, title, original_title) VALUES ('delete', old.id, old.title, old.original_title);
+            END;
+            -- Every TMDB response upserts the movies in it, only a new title needs reindexing.
+            -- Replaces known_movies_au, which reindexed on every upsert
+            DROP TRIGGER IF EXISTS known_movies_au;
+            CREATE TRIGGER IF NOT EXISTS known_movies_title_au AFTER UPDATE ON known_movies
+            WHEN old.title IS NOT new.title OR old.original_title IS NOT new.original_title BEGIN
+                INSERT INTO movie_search (movie_search, rowid, title, original_title) VALUES ('delete', old.id, old.title, old.original_title);
+                INSERT INTO movie_search (rowid, title, original_title) VALUES (new.id, new.title, new.original_title);
+            END;
+            CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5(
+                original_title,
+                content='catalog_movies', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            CREATE TRIGGER IF NOT EXISTS catalog_movies_ai AFTER INSERT ON catalog_movies BEGIN
+                INSERT INTO catalog_search (rowid, original_title) VALUES (new.id, new.original_title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS catalog_movies_ad AFTER DELETE ON catalog_movies BEGIN
+                INSERT INTO catalog_search (catalog_search, rowid, original_title) VALUES ('delete', old.id, old.original_title);
+            END;
+            -- Popularity changes in every export, only a new title needs reindexing
+            CREATE TRIGGER IF NOT EXISTS catalog_movies_au AFTER UPDATE ON catalog_movies
+            WHEN old.original_title IS NOT new.original_title BEGIN
+                INSERT INTO catalog_search (catalog_search, rowid, original_title) VALUES ('delete', old.id, old.original_title);
+                INSERT INTO catalog_search (rowid, original_title) VALUES (new.id, new.original_title);
+            END;
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite was built without FTS5, searches always go to TMDB
+        print(f"Local search index unavailable: {e}")
+
     conn.commit()
-    conn.close()
+    migrate_db(conn)
+
+
+# Schema changes to tables create_tables already made, applied in order.
+# The database's PRAGMA user_version is the number of migrations it has had,
+# add new ones to the end and never edit one that has shipped.
+MIGRATIONS = [
+    # 1: Watchlist columns so the homepage can sort, filter and paginate in SQL
+    [
+        "ALTER TABLE user_movies ADD COLUMN title TEXT",
+        "ALTER TABLE user_movies ADD COLUMN year INTEGER",
+        "ALTER TABLE user_movies ADD COLUMN runtime INTEGER",
+        "ALTER TABLE user_movies ADD COLUMN vote_average REAL",
+        "ALTER TABLE user_movies ADD COLUMN genres TEXT",
+        "ALTER TABLE user_movies ADD COLUMN poster_path TEXT",
+        "ALTER TABLE user_movies ADD COLUMN added_at REAL",
+        "CREATE INDEX user_movies_movie ON user_movies (movie_id)",
+        "CREATE INDEX user_movies_added ON user_movies (user_id, added_at)",
+        "CREATE INDEX user_movies_rating ON user_movies (user_id, vote_average)",
+        "CREATE INDEX user_movies_year ON user_movies (user_id, year)",
+        "CREATE INDEX user_movies_title ON user_movies (user_id, title COLLATE NOCASE)",
+        "CREATE INDEX user_movies_runtime ON user_movies (user_id, runtime)",
+    ],
+    # 2: Original title and overview shown on the homepage like the movie and search pages,
+    #    and movie_id added to the sort indexes as the tiebreaker WATCHLIST_SORTS uses
+    [
+        "ALTER TABLE user_movies ADD COLUMN original_title TEXT",
+        "ALTER TABLE user_movies ADD COLUMN overview TEXT",
+        """
+            UPDATE user_movies SET
+                original_title = coalesce((SELECT k.original_title FROM known_movies k WHERE k.id = movie_id), title),
+                overview = coalesce((SELECT k.overview FROM known_movies k WHERE k.id = movie_id), '')
+            WHERE title IS NOT NULL
+        """,
+        "DROP INDEX user_movies_added",
+        "DROP INDEX user_movies_rating",
+        "DROP INDEX user_movies_year",
+        "DROP INDEX user_movies_title",
+        "DROP INDEX user_movies_runtime",
+        "CREATE INDEX user_movies_added ON user_movies (user_id, added_at, movie_id)",
+        "CREATE INDEX user_movies_rating ON user_movies (user_id, vote_average, movie_id)",
+        "CREATE INDEX user_movies_year ON user_movies (user_id, year, movie_id)",
+        "CREATE INDEX user_movies_title ON user_movies (user_id, original_title COLLATE NOCASE, movie_id)",
+        "CREATE INDEX user_movies_runtime ON user_movies (user_id, runtime, movie_id)",
+    ],
+]
+
+
+def migrate_db(conn):
+    """
+        Applies the migrations the database hasn't had yet, one transaction each.
+        Safe to run from several worker processes starting at once, the write
+        lock is taken before the version is read.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
 
 
 def is_logged_in(id):
@@ -53,22 +330,246 @@ def is_logged_in(id):
         "username": user[1],
         "email": user[2],
     }
-    conn.close()
     return user_dict
 
 
-def get_saved_movies(user_id):
-    """Returns a list of the saved movies for the user id"""
+# Homepage watchlist sort options, the label and the ORDER BY each uses.
+# Every order has a matching user_movies index.
+# movie_id breaks ties, so paging with LIMIT and OFFSET never repeats or skips a movie.
+# Each order matches an index on user_movies, read forwards or backwards
+WATCHLIST_SORTS = {
+    "added": ("Recently added", "added_at DESC, movie_id DESC"),
+    "rating": ("Rating", "vote_average DESC, movie_id DESC"),
+    "year": ("Newest", "year DESC, movie_id DESC"),
+    "title": ("Title", "original_title COLLATE NOCASE, movie_id"),
+    "runtime": ("Shortest", "runtime, movie_id"),
+}
+
+# Movie details copied into each user_movies row
+WATCHLIST_COLUMNS = ("title", "original_title", "overview", "year", "runtime", "vote_average", "genres", "poster_path")
+
+# Saves a movie to a user's list with its watchlist columns, ignored if it is already saved
+INSERT_WATCHLIST_MOVIE = f"""
+    INSERT OR IGNORE INTO user_movies (user_id, movie_id, {", ".join(WATCHLIST_COLUMNS)}, added_at)
+    VALUES (?, ?, {", ".join("?" * len(WATCHLIST_COLUMNS))}, ?)
+"""
+
+
+def watchlist_options():
+    """Returns the sort, genre and page of the homepage watchlist from the query string"""
+    sort = request.args.get("sort", "added")
+    if sort not in WATCHLIST_SORTS:
+        sort = "added"
+    return sort, request.args.get("genre") or None, max(request.args.get("page", 1, type=int), 1)
+
+
+def get_saved_movies(user_id, sort="added", genre=None, page=1):
+    """
+        Returns a page of the saved movies for the user id, see read_watchlist.
+        Movies saved before their details were known are loaded and stored,
+        except movies TMDB answered 404 for, which stay placeholders until their backoff runs out.
+    """
+    watchlist = read_watchlist(user_id, sort, genre, page)
+    missing = [movie["id"] for movie in watchlist["movies"] if movie["title"] is None]
+    if missing:
+        backed_off = backed_off_movies(missing)
+        loaded = hydrate_movies([id for id in missing if id not in backed_off])
+        # Checked again for the movies TMDB just answered 404 for
+        fill_watchlist_movies(watchlist["movies"], loaded, backed_off_movies(missing))
+    return watchlist
+
+
+def read_watchlist(user_id, sort="added", genre=None, page=1, page_size=WATCHLIST_PAGE_SIZE):
+    """
+        Returns a dict with one page of a user's saved movies read from the
+        watchlist columns, sorted and optionally only one genre, along with
+        the page count and every genre in the list. Makes no TMDB calls.
+        Parameters:
+        - user_id (int): user whose watchlist is read
+        - sort (str): key of WATCHLIST_SORTS
+        - genre (str): only movies with this genre, or None for all
+        - page (int): page number starting at 1
+        - page_size (int): movies per page
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    where = "user_id = ?"
+    params = [user_id]
+    if genre:
+        # Genres are stored comma separated, match whole names only
+        where += " AND instr(',' || genres || ',', ?) > 0"
+        params.append(f",{genre},")
+
+    cur.execute(f"SELECT count(*) FROM user_movies WHERE {where}", params)
+    pages = max(math.ceil(cur.fetchone()[0] / page_size), 1)
+    cur.execute(f"""
+        SELECT movie_id, {", ".join(WATCHLIST_COLUMNS)} FROM user_movies
+        WHERE {where} ORDER BY {WATCHLIST_SORTS[sort][1]} LIMIT ? OFFSET ?
+    """, (*params, page_size, (page - 1) * page_size))
+    movies = [watchlist_movie(row[0], row[1:]) for row in cur.fetchall()]
+
+    cur.execute("SELECT DISTINCT genres FROM user_movies WHERE user_id = ? AND genres != ''", (user_id,))
+    genres = sorted({name for row in cur.fetchall() for name in row[0].split(",")})
+    return {"movies": movies, "page": page, "pages": pages, "sort": sort, "genre": genre, "genres": genres}
+
+
+def watchlist_movie(movie_id, values):
+    """Returns the dict the homepage renders for a movie from its watchlist column values"""
+    movie = dict(zip(WATCHLIST_COLUMNS, values), id=movie_id)
+    movie["genres"] = movie["genres"].split(",") if movie["genres"] else []
+    return movie
+
+
+def watchlist_columns(movie):
+    """Returns the WATCHLIST_COLUMNS values for a movie's details"""
+    year = movie.release_date[:4] if movie.release_date else ''
+    return (
+        movie.title or movie.original_title or '',
+        movie.original_title or movie.title or '',
+        movie.overview or '',
+        int(year) if year.isdigit() else None,
+        movie.runtime,
+        movie.vote_average,
+        ",".join(genre.name for genre in movie.genres),
+        movie.poster_path,
+    )
+
+
+def fill_watchlist_movies(movies, loaded, not_found=()):
+    """
+        Fills in watchlist movies that have no details from the loaded movie info
+        and stores it so they are read from the watchlist columns next time.
+        Movies that failed to load are marked as placeholders, titled from the movie catalog if it has them.
+        Placeholders for the ids in not_found, movies TMDB answered 404 for, are also marked not_found.
+    """
+    details = {movie.id: movie for movie in loaded if not isinstance(movie, dict)}
+    update_watchlist_movies(details.values())
+    for movie in movies:
+        if movie["title"] is None:
+            info = details.get(movie["id"])
+            if info:
+                movie.update(watchlist_movie(movie["id"], watchlist_columns(info)))
+            else:
+                movie["placeholder"] = True
+                movie["not_found"] = movie["id"] in not_found
+
+    # Placeholders show the catalog title when there is one
+    missing = [movie["id"] for movie in movies if movie.get("placeholder")]
+    if missing:
+        titles = catalog_titles(missing)
+        for movie in movies:
+            if movie.get("placeholder"):
+                movie["title"] = titles.get(movie["id"])
+
+
+def update_watchlist_movies(movies):
+    """
+        Copies the details of each movie into every watchlist row saving it.
+        Users whose rows changed get their watchlist version bumped so their
+        homepage is not answered with 304.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
+    columns = ", ".join(WATCHLIST_COLUMNS)
+    for movie in movies:
+        values = watchlist_columns(movie)
+        cur.execute(f"""
+            UPDATE user_movies SET ({columns}) = ({", ".join("?" * len(values))})
+            WHERE movie_id = ? AND ({columns}) IS NOT ({", ".join("?" * len(values))})
+        """, (*values, movie.id, *values))
+        if cur.rowcount:
+            cur.execute("""
+                INSERT INTO watchlist_versions (user_id, version)
+                SELECT user_id, 1 FROM user_movies WHERE movie_id = ?
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+            """, (movie.id,))
+    conn.commit()
+
+
+def backfill_watchlist(batch_size=100, on_progress=None):
+    """
+        Fills in the watchlist columns of movies saved before they existed,
+        loading a batch of movie ids at a time from the cache or TMDB.
+        Movies TMDB answered 404 for are skipped until their backoff runs out.
+        Stopping and running it again picks up where it left off.
+        Returns the number of movies filled in and the number that failed to load.
+        Parameters:
+        - batch_size (int): movie ids loaded at once
+        - on_progress (callable): called with the filled and failed counts after each batch
+    """
+    conn = get_db_connection()
+    last_id = None
+    filled = failed = 0
+    while True:
+        cur = conn.execute("""
+            SELECT DISTINCT movie_id FROM user_movies
+            WHERE title IS NULL AND movie_id > coalesce(?, -1)
+                AND movie_id NOT IN (SELECT movie_id FROM missing_movies WHERE retry_at > ?)
+            ORDER BY movie_id LIMIT ?
+        """, (last_id, time.time(), batch_size))
+        movie_ids = [row[0] for row in cur.fetchall()]
+        if not movie_ids:
+            return filled, failed
+        # No page is waiting on these, give every call time to finish
+        loaded = [movie for movie in hydrate_movies(movie_ids, deadline=60 * 60) if not isinstance(movie, dict)]
+        update_watchlist_movies(loaded)
+        filled += len(loaded)
+        failed += len(movie_ids) - len(loaded)
+        last_id = movie_ids[-1]
+        if on_progress:
+            on_progress(filled, failed)
+
+
+def hydrate_movies(movie_ids, max_concurrency=WATCHLIST_MAX_CONCURRENCY, deadline=WATCHLIST_DEADLINE):
+    """
+        Fetches movie info for each id on the shared TMDB pool.
+        At most max_concurrency calls are in flight for this request and
+        any movie not loaded within deadline seconds, or that failed to
+        load, is returned as a placeholder so the page can still render.
+        Parameters:
+        - movie_ids (list): movie ids in the order they should be returned
+        - max_concurrency (int): most calls in flight at once
+        - deadline (float): seconds to wait for all movies
+    """
+    # TMDB is down, don't queue calls that would only be refused
+    if tmdb_breaker.is_open():
+        return [{"id": id, "placeholder": True} for id in movie_ids]
+
+    end = time.monotonic() + deadline
+    remaining = iter(movie_ids)
+    in_flight = {}
+    loaded = {}
 
-    cur.execute("SELECT movie_id FROM user_movies WHERE user_id = ?", (user_id,))
-    movie_ids = cur.fetchall()
-    conn.close()
+    # Start the first batch of calls
+    for id in remaining:
+        in_flight[submit_timed(tmdb_executor, get_movie_info, id)] = id
+        if len(in_flight) >= max_concurrency:
+            break
+
+    while in_flight:
+        timeout = end - time.monotonic()
+        if timeout <= 0:
+            break
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            id = in_flight.pop(future)
+            if not future.exception():
+                loaded[id] = future.result()
+            # Keep the window full with the next id
+            next_id = next(remaining, None)
+            if next_id is not None:
+                in_flight[submit_timed(tmdb_executor, get_movie_info, next_id)] = next_id
+
+    # Deadline hit, don't start calls that are still queued
+    for future in in_flight:
+        future.cancel()
 
     movie_list = []
     for id in movie_ids:
-        movie_list.append(get_movie_info(id[0]))
+        movie = loaded.get(id)
+        if movie is None:
+            movie = {"id": id, "placeholder": True}
+        movie_list.append(movie)
     return movie_list
 
 
@@ -138,28 +639,23 @@ def validate_form_field(form_data, form_field, type):
     # Username field
     if form_field == "username":
         if len(form_data.get(form_field)) < 2:
-            conn.close()
             return "Username must be at least 2 characters"
         cur.execute("SELECT * FROM users WHERE username = ?", (form_data.get(form_field),))
         user = cur.fetchone()
         if user:
-            conn.close()
             return "Username already exists"
 
     # Email field
     elif form_field == "email" and not type == "reset":
         if not form_data.get(form_field) or not EMAIL_PATTERN.match(form_data.get(form_field)):
-            conn.close()
             return "Not a valid email"
         # If it's the signup form, check that email is not in use
         cur.execute("SELECT * FROM users WHERE email = ?", (form_data.get(form_field),))
         user = cur.fetchone()
         if type == "signup":
             if user:
-                conn.close()
                 return "Email already in use"
         elif not user:
-            conn.close()
             return "Email not found"
 
     # Password field
@@ -167,28 +663,33 @@ def validate_form_field(form_data, form_field, type):
         if type == "login" and form_data.get("email"):
             cur.execute("SELECT password_hash FROM users WHERE email = ?", (form_data.get("email"),))
             user = cur.fetchone()
-            if user and not check_password_hash(user[0], form_data.get(form_field)):
-                conn.close()
-                return "Incorrect password"
+            if user:
+                try:
+                    if not verify_password(user[0], form_data.get(form_field)):
+                        return "Incorrect password"
+                    # Upgrade hashes made with an older cost now that the password is known
+                    if needs_rehash(user[0]):
+                        cur.execute("UPDATE users SET password_hash = ? WHERE email = ?", (hash_password(form_data.get(form_field)), form_data.get("email")))
+                        conn.commit()
+                except HashQueueFull:
+                    return HASH_BUSY_ERR
         elif not form_data.get(form_field) or not PASSWORD_PATTERN.match(form_data.get(form_field)):
-            conn.close()
             return PASSWORD_ERR
         # For reset password page, make sure new password is not the same as the old one
         if type == "reset" and form_data.get("password") and form_data.get("email"):
             cur.execute("SELECT password_hash FROM users WHERE email = ?", (form_data.get("email"),))
             user_pw = cur.fetchone()
-            if check_password_hash(user_pw[0], form_data.get("password")):
-                conn.close()
-                return "The new password cannot be the same as a previously used password"
+            try:
+                if verify_password(user_pw[0], form_data.get("password")):
+                    return "The new password cannot be the same as a previously used password"
+            except HashQueueFull:
+                return HASH_BUSY_ERR
 
     # Confirm password field
     elif form_field == "password-confirm" and form_data.get("password"):
         if not form_data.get(form_field) or not form_data.get(form_field) == form_data.get("password"):
-            conn.close()
             return "Passwords must match"
 
-    # Close database connection
-    conn.close()
     return
 
 
@@ -202,6 +703,15 @@ def handle_valid_submission(form_data, form_type):
     conn = get_db_connection()
     cur = conn.cursor()
 
+    # Hash new passwords before touching the session or database
+    try:
+        if form_type in ("signup", "reset"):
+            pw_hash = hash_password(form_data.get("password"))
+    except HashQueueFull:
+        session[FLASH_KEY] = "danger"
+        flash(HASH_BUSY_ERR, session.get(FLASH_KEY))
+        return False
+
     # User attempting to login
     if form_type == "login":
         # Forget any user session data
@@ -209,7 +719,6 @@ def handle_valid_submission(form_data, form_type):
         # Get user_id and username
         cur.execute("SELECT id, username FROM users WHERE email = ?", (form_data.get("email"),))
         user = cur.fetchone()
-        conn.close()
         session["user_id"] = user[0]
         session["username"] = user[1]
         # Keep user logged in for 30 days if checkbox is checked
@@ -218,7 +727,6 @@ def handle_valid_submission(form_data, form_type):
 
     # User attempting to signup
     elif form_type == "signup":
-        pw_hash = generate_password_hash(form_data.get("password"), method="pbkdf2", salt_length=16)
         cur.execute("""
             INSERT INTO users
             (username, email, password_hash)
@@ -226,27 +734,19 @@ def handle_valid_submission(form_data, form_type):
         """, (form_data["username"], form_data.get("email"), pw_hash))
         # Get rows inserted
         if cur.rowcount < 1:
-            conn.close()
             print("Error signing up user")
             return False
         conn.commit()
         cur.execute("SELECT id, username FROM users WHERE email = ?", (form_data.get("email"),))
         user = cur.fetchone()
-        conn.close()
         session["user_id"] = user[0]
         session["username"] = user[1]
 
     # User is attempting to change passwords
     elif form_type == "reset":
-        new_pw_hash = generate_password_hash(
-            form_data.get("password"),
-            method="pbkdf2",
-            salt_length=16)
-        cur.execute("UPDATE users SET password_hash = ? WHERE email = ?", (new_pw_hash, form_data.get("email")))
+        cur.execute("UPDATE users SET password_hash = ? WHERE email = ?", (pw_hash, form_data.get("email")))
         conn.commit()
-        conn.close()
 
-    conn.close()
     return True
 
 
@@ -258,12 +758,10 @@ def is_movie_saved(movie_id):
     user_id = session.get("user_id")
 
     if not user_id:
-        conn.close()
         return False
 
     cur.execute("SELECT * FROM user_movies WHERE user_id = ? AND movie_id = ?", (user_id, movie_id))
     movie = cur.fetchone()
-    conn.close()
     if movie:
         return True
     else:
@@ -278,22 +776,31 @@ def save_movie(movie_id):
     # Get user id
     user_id = session.get("user_id")
     if not user_id:
-        conn.close()
         session[FLASH_KEY] = "danger"
         flash("Must be logged in to save movie.", session.get(FLASH_KEY))
         return
 
-    if is_movie_saved(movie_id):
+    # Copy the movie details into the row so the homepage needs no TMDB calls,
+    # left empty for backfill_watchlist if they can't be loaded
+    try:
+        movie = get_movie_info(movie_id)
+    except TMDB_ERRORS:
+        movie = None
+    if movie is None and backed_off_movies([movie_id]):
         session[FLASH_KEY] = "danger"
-        flash("Movie already saved.", session.get(FLASH_KEY))
-    else:
-        # Insert movie into database
-        cur.execute("INSERT INTO user_movies (user_id, movie_id) VALUES (?, ?)", (user_id, movie_id))
+        flash("Movie not found.", session.get(FLASH_KEY))
+        return
+    values = watchlist_columns(movie) if movie else (None,) * len(WATCHLIST_COLUMNS)
+    # Insert movie into database, ignored if it is already saved
+    cur.execute(INSERT_WATCHLIST_MOVIE, (user_id, movie_id, *values, time.time()))
+    if cur.rowcount:
+        bump_watchlist_version(cur, user_id)
         conn.commit()
         session[FLASH_KEY] = "success"
         flash("Successfully saved movie!", session.get(FLASH_KEY))
-
-    conn.close()
+    else:
+        session[FLASH_KEY] = "danger"
+        flash("Movie already saved.", session.get(FLASH_KEY))
 
 
 def remove_movie(movie_id):
@@ -303,12 +810,13 @@ def remove_movie(movie_id):
 
     user_id = session.get("user_id")
     if not user_id:
-        conn.close()
         session[FLASH_KEY] = "danger"
         flash("Must be logged in to remove movie.", session.get(FLASH_KEY))
         return
 
     cur.execute("DELETE FROM user_movies WHERE user_id = ? AND movie_id = ?", (user_id, movie_id))
+    if cur.rowcount:
+        bump_watchlist_version(cur, user_id)
     conn.commit()
     cur.execute("SELECT * FROM user_movies WHERE user_id = ? AND movie_id = ?", (user_id, movie_id))
     movie = cur.fetchone()
@@ -320,19 +828,570 @@ def remove_movie(movie_id):
         # Movie no longer exists and was successfully deleted
         session[FLASH_KEY] = "success"
         flash("Movie successfully removed.", session.get(FLASH_KEY))
-    conn.close()
 
 
-def search_query(query):
-    """Makes call to api to get list of movies"""
-    response = requests.get(f"https://api.themoviedb.org/3/search/movie?api_key={TMDB_API_KEY}&query={query}&include_adult=false&language=en-US&page=1")
-    return jsonify(response.json())
+def bulk_update_watchlist(user_id, add=(), remove=()):
+    """
+        Saves and removes many movies on a user's list in one transaction,
+        saves of movies already on the list are skipped. The watchlist columns
+        are filled from cached movie details only, movies without them are
+        filled in when the homepage shows them or by backfill_watchlist.
+        Returns the number of movies saved and the number removed.
+        Parameters:
+        - user_id (int): user whose list is changed
+        - add (list): movie ids to save
+        - remove (list): movie ids to remove
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    added_at = time.time()
+    empty = (None,) * len(WATCHLIST_COLUMNS)
+    saved = removed = 0
+    for start in range(0, len(add), WATCHLIST_BATCH_SIZE):
+        batch = add[start:start + WATCHLIST_BATCH_SIZE]
+        columns = cached_watchlist_columns(batch)
+        cur.executemany(INSERT_WATCHLIST_MOVIE, ((user_id, id, *columns.get(id, empty), added_at) for id in batch))
+        saved += cur.rowcount
+    if remove:
+        cur.executemany("DELETE FROM user_movies WHERE user_id = ? AND movie_id = ?", ((user_id, id) for id in remove))
+        removed = cur.rowcount
+    if saved or removed:
+        bump_watchlist_version(cur, user_id)
+    conn.commit()
+    return saved, removed
+
+
+def cached_watchlist_columns(movie_ids):
+    """Returns a dict of movie id to WATCHLIST_COLUMNS values for the movies with cached details"""
+    cur = get_db_connection().cursor()
+    cur.execute(f"""
+        SELECT movie_id, payload FROM tmdb_cache
+        WHERE payload_type = 'details' AND movie_id IN ({", ".join("?" * len(movie_ids))})
+    """, movie_ids)
+    return {row[0]: watchlist_columns(decode_payload("details", row[1])) for row in cur.fetchall()}
+
+
+# Largest integer SQLite can store, bigger ids overflow when bound to a query
+MAX_MOVIE_ID = 2 ** 63 - 1
+
+
+def parse_movie_ids(values):
+    """Returns the values as a list of movie ids without duplicates, raising ValueError if any isn't an integer from 1 to MAX_MOVIE_ID"""
+    movie_ids = []
+    for value in values:
+        # bool is an int subclass, true is never an id
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError(f"Invalid movie id: {value!r}")
+        movie_id = int(value)
+        if not 1 <= movie_id <= MAX_MOVIE_ID:
+            raise ValueError(f"Invalid movie id: {value!r}")
+        movie_ids.append(movie_id)
+    return list(dict.fromkeys(movie_ids))
+
+
+def export_watchlist(user_id, format="csv"):
+    """
+        Yields a user's watchlist as csv or json lines, a batch of rows at a time.
+        Reads with one query so the export is a consistent snapshot,
+        memory use stays the same however long the list is.
+    """
+    cur = get_db_connection().cursor()
+    cur.execute(f"""
+        SELECT movie_id, {", ".join(WATCHLIST_COLUMNS)}, added_at FROM user_movies
+        WHERE user_id = ? ORDER BY added_at
+    """, (user_id,))
+    fields = ("movie_id", *WATCHLIST_COLUMNS, "added_at")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        # Sent on its own, an empty watchlist still exports the header
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    while rows := cur.fetchmany(WATCHLIST_BATCH_SIZE):
+        for row in rows:
+            row = list(row)
+            # Seconds since the epoch are written as UTC ISO 8601 times
+            if row[-1] is not None:
+                row[-1] = datetime.fromtimestamp(row[-1], timezone.utc).isoformat(timespec="seconds")
+            if format == "csv":
+                writer.writerow(row)
+            else:
+                movie = dict(zip(fields, row))
+                movie["genres"] = movie["genres"].split(",") if movie["genres"] else []
+                buffer.write(json.dumps(movie) + "\n")
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# Csv columns and json keys an imported movie id is read from, first one with a value wins
+IMPORT_ID_COLUMNS = ("movie_id", "tmdb_id", "id")
+
+# Bytes of an upload kept in memory while it is checked, larger uploads go to a temporary file
+IMPORT_SPOOL_BYTES = 1024 * 1024
+
+
+def import_watchlist(user_id, stream, format="csv"):
+    """
+        Saves every movie id in an uploaded csv or json lines file to a user's
+        list, reading and saving a batch at a time so memory use stays the same
+        however big the file is. Csv files need a movie_id, tmdb_id or id column,
+        json lines can be objects with one of those keys or bare ids.
+        Returns the number of movies saved and the number of rows skipped.
+        Raises ValueError, before anything is saved, if the file isn't UTF-8
+        or a csv file has none of the id columns.
+        Parameters:
+        - user_id (int): user whose list the movies are saved to
+        - stream (binary file): the uploaded file
+        - format (str): csv or jsonl
+    """
+    with spool_upload(stream) as upload:
+        lines = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+        if format == "csv":
+            rows = csv.DictReader(lines)
+            if not set(IMPORT_ID_COLUMNS) & set(rows.fieldnames or ()):
+                raise ValueError("Csv files need a movie_id, tmdb_id or id column.")
+        else:
+            rows = (line for line in lines if line.strip())
+        saved = skipped = 0
+        while batch := list(itertools.islice(rows, WATCHLIST_BATCH_SIZE)):
+            movie_ids = []
+            for row in batch:
+                movie_id = import_row_movie_id(row, format)
+                if movie_id is None:
+                    skipped += 1
+                else:
+                    movie_ids.append(movie_id)
+            if movie_ids:
+                # Each batch is its own transaction so a long import doesn't hold the write lock
+                saved += bulk_update_watchlist(user_id, list(dict.fromkeys(movie_ids)))[0]
+    return saved, skipped
+
+
+def spool_upload(stream):
+    """
+        Copies an upload to a temporary file, rewound to the start, checking on the
+        way that it is UTF-8 so a bad file is refused before any batch is saved.
+        Raises ValueError if it isn't UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    upload = tempfile.SpooledTemporaryFile(IMPORT_SPOOL_BYTES)
+    try:
+        while chunk := stream.read(64 * 1024):
+            decoder.decode(chunk)
+            upload.write(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError as e:
+        upload.close()
+        raise ValueError("File must be UTF-8 text.") from e
+    upload.seek(0)
+    return upload
+
+
+def import_row_movie_id(row, format):
+    """Returns the movie id of an imported csv row or json line, or None if it has none"""
+    if format == "csv":
+        value = next(filter(None, (row.get(column) for column in IMPORT_ID_COLUMNS)), None)
+    else:
+        try:
+            value = json.loads(row)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(value, dict):
+            value = next(filter(None, (value.get(column) for column in IMPORT_ID_COLUMNS)), None)
+    try:
+        return parse_movie_ids([value])[0]
+    except ValueError:
+        return None
+
+
+def bump_watchlist_version(cur, user_id):
+    """Increments the watchlist version of a user, committed with the watchlist change"""
+    cur.execute("""
+        INSERT INTO watchlist_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    """, (user_id,))
+
+
+def make_etag(*parts):
+    """Returns a strong ETag value built from the values a response depends on"""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def not_modified(etag, private=True):
+    """Returns a 304 response if the request's If-None-Match matches the etag, otherwise None"""
+    if etag and request.if_none_match.contains(etag):
+        return set_etag(Response(status=304), etag, private)
+    return None
+
+
+def set_etag(response, etag, private=True):
+    """Sets a strong ETag and makes clients revalidate before reusing the response"""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    return response
+
+
+def watchlist_etag(user_id, sort="added", genre=None, page=1):
+    """
+        Returns the homepage ETag for a user, built from their watchlist version
+        and the watchlist options. The version is bumped whenever a row changes.
+        Returns None while a saved movie has no details yet, the page must be
+        rendered to load them. Movies TMDB answered 404 for don't count while backed off.
+    """
+    if not user_id:
+        return make_etag(TEMPLATE_VERSION, None)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM watchlist_versions WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    version = row[0] if row else 0
+    cur.execute("""
+        SELECT 1 FROM user_movies
+        WHERE user_id = ? AND title IS NULL AND movie_id NOT IN (SELECT movie_id FROM missing_movies WHERE retry_at > ?)
+        LIMIT 1
+    """, (user_id, time.time()))
+    if cur.fetchone():
+        return None
+    return make_etag(TEMPLATE_VERSION, user_id, session.get("username"), version, sort, genre, page)
+
+
+def movie_etag(id, is_saved):
+    """
+        Returns the movie page ETag, built from the stored movie page info version.
+        Returns None if the page info isn't stored or its payloads are stale.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT built_at FROM movie_views WHERE movie_id = ? AND version = ?", (id, MOVIE_VIEW_VERSION))
+    row = cur.fetchone()
+    if not row:
+        return None
+    cur.execute("SELECT payload_type, fetched_at FROM tmdb_cache WHERE movie_id = ?", (id,))
+    fetched = cur.fetchall()
+    if len(fetched) < len(TMDB_CACHE_TTL) or any(is_stale(payload_type, fetched_at) for payload_type, fetched_at in fetched):
+        return None
+    return make_etag(TEMPLATE_VERSION, MOVIE_VIEW_VERSION, id, row[0], session.get("user_id"), session.get("username"), is_saved)
+
+
+def normalize_query(query):
+    """Normalizes unicode, case and whitespace so equivalent queries share a cache key"""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def search_query(query, compact=False, overview_chars=None, page=1, local=False):
+    """
+        Makes call to api to get a page of movies, answered from the search cache
+        or, if local is set, the local title index when possible
+        Parameters:
+        - query (str): search text
+        - compact (bool): only return the fields the search results use
+        - overview_chars (int): truncate overviews in compact results to this length
+        - page (int): page of results, starting at 1
+        - local (bool): answer page 1 from the local title index if it has enough matches.
+          Its answer is a single page, so only callers that show one page, like the
+          search bar, should set it
+    """
+    return Response(get_search_page(query, compact, overview_chars, page, local), mimetype="application/json")
+
+
+def stream_search_query(query, compact=False, overview_chars=None, max_pages=SEARCH_STREAM_MAX_PAGES):
+    """
+        Generator of newline delimited json search pages.
+        Page 1 is fetched first to learn the page count, the rest are fetched
+        concurrently and each is sent as soon as it arrives.
+    """
+    first_page = get_search_page(query, compact, overview_chars, 1)
+    yield ndjson_line(first_page)
+
+    total_pages = json.loads(first_page).get("total_pages") or 1
+    futures = [tmdb_executor.submit(get_search_page, query, compact, overview_chars, page)
+               for page in range(2, min(total_pages, max_pages) + 1)]
+    for future in as_completed(futures):
+        yield ndjson_line(future.result())
+
+
+def ndjson_line(content):
+    """Returns json bytes as a single newline terminated line"""
+    if b"\n" in content:
+        content = json.dumps(json.loads(content)).encode()
+    return content + b"\n"
+
+
+def get_search_page(query, compact=False, overview_chars=None, page=1, local=False):
+    """Returns the json bytes for a page of search results, see search_query"""
+    query = normalize_query(query)
+    page = min(max(page, 1), 500)
+    cache_key = search_cache_key(query, compact, overview_chars, page)
+    content = get_local_search_page(cache_key, query, compact, overview_chars, page, local)
+    if content is not None:
+        return content
+    # TMDB is down, answer right away instead of waiting on a call already in flight
+    if tmdb_breaker.is_open():
+        return catalog_search_page(query, compact, overview_chars, page)
+    # Identical searches running at the same time share one TMDB call
+    return single_flight.do(f"search:{cache_key}", lambda: request_search_page(cache_key, query, compact, overview_chars, page))
+
+
+def request_search_page(cache_key, query, compact=False, overview_chars=None, page=1):
+    """
+        Makes the TMDB search call for get_search_page. When TMDB fails, is too slow
+        or the circuit breaker is open the search is answered from the movie catalog.
+    """
+    try:
+        response = tmdb_client.get("search", "/search/movie", **search_params(query, page))
+    except TMDB_ERRORS:
+        return catalog_search_page(query, compact, overview_chars, page)
+    if not response.ok:
+        return catalog_search_page(query, compact, overview_chars, page)
+    return handle_search_response(cache_key, response.ok, response.content, compact, overview_chars)
+
+
+def search_etag(query, compact=False, overview_chars=None, page=1, local=False):
+    """
+        Returns the ETag of a page of search results, built from its search cache key and the
+        version of the cached page, so a client's copy is checked without calling TMDB.
+        Returns None if the page isn't cached. Pages answered from the movie catalog
+        never are, so they aren't reused once TMDB is back.
+    """
+    cache_key = search_cache_key(normalize_query(query), compact, overview_chars, min(max(page, 1), 500))
+    # Same lookup order as get_local_search_page
+    version = search_cache.version(cache_key)
+    if version is None and local and page == 1:
+        version = search_cache.version(local_search_cache_key(cache_key))
+    if version is None:
+        return None
+    stored_at, size = version
+    # One validator per content encoding, compress_response picks it from the body size
+    return make_etag(cache_key, stored_at, choose_encoding(size))
+
+
+def search_cache_key(query, compact, overview_chars, page):
+    """Returns the search cache key for a normalized query"""
+    return f"{int(compact)}:{overview_chars or ''}:{page}:{query}"
+
+
+def local_search_cache_key(cache_key):
+    """Returns the search cache key of the local title index answer for a page"""
+    return f"local:{cache_key}"
+
+
+def get_local_search_page(cache_key, query, compact=False, overview_chars=None, page=1, local=False):
+    """
+        Returns a search page from the search cache, or if local is set from the local
+        title index when it has enough matches. Returns None if TMDB has to be called.
+        Local answers are a single page and are cached apart from TMDB's pages,
+        so callers paging through the results never get one.
+    """
+    cached = search_cache.get(cache_key)
+    if cached is not None or not local or page != 1:
+        return cached
+
+    local_key = local_search_cache_key(cache_key)
+    cached = search_cache.get(local_key)
+    if cached is not None:
+        return cached
+    local_results = search_local_index(query)
+    if len(local_results) < SEARCH_LOCAL_MIN_RESULTS:
+        return None
+    payload = SearchPage(page=1, results=local_results, total_pages=1, total_results=len(local_results))
+    content = encoder.encode(compact_search_payload(payload, overview_chars) if compact else payload)
+    search_cache.set(local_key, content)
+    return content
+
+
+def search_params(query, page):
+    """Returns the query string parameters for a TMDB search call"""
+    return {"query": query, "include_adult": "false", "language": "en-US", "page": page}
+
+
+def handle_search_response(cache_key, ok, content, compact=False, overview_chars=None):
+    """
+        Indexes and caches the body of a TMDB search response, returning the json bytes to send.
+        Error responses are passed through without being cached.
+    """
+    if not ok:
+        return content
+    payload = search_page_decoder.decode(content)
+    index_known_movies(payload.results)
+    if compact:
+        content = encoder.encode(compact_search_payload(payload, overview_chars))
+    search_cache.set(cache_key, content)
+    return content
+
+
+def compact_search_payload(payload, overview_chars=None, page_type=CompactSearchPage):
+    """Keeps only the search result fields the client reads, optionally truncating overviews"""
+    results = []
+    for movie in payload.results:
+        overview = movie.overview
+        if overview_chars and overview and len(overview) > overview_chars:
+            overview = overview[:overview_chars].rstrip() + "…"
+        results.append(CompactSearchResult(movie.id, movie.original_title, movie.release_date, movie.poster_path, overview))
+    return page_type(payload.page, results, payload.total_pages, payload.total_results)
+
+
+def compress_response(response):
+    """
+        Compresses a response body with brotli or gzip when the client accepts it
+        and the body is at least COMPRESS_MIN_BYTES long
+    """
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+
+    encoding = choose_encoding(response.content_length)
+    if encoding == "br":
+        response.set_data(brotli.compress(response.get_data(), quality=4))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def choose_encoding(length):
+    """Returns the content encoding compress_response uses for a body of this length, or None"""
+    if length is None or length < COMPRESS_MIN_BYTES:
+        return None
+    accepted = request.headers.get("Accept-Encoding", '')
+    if brotli and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def search_local_index(query, limit=20):
+    """
+        Returns movies from the local title index matching every word of the
+        query as a prefix, ranked by text match, popularity and vote count
+    """
+    match = fts_match(query)
+    if not match:
+        return []
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT k.id, k.title, k.original_title, k.release_date, k.poster_path, k.overview, k.popularity, k.vote_count, bm25(movie_search)
+            FROM movie_search JOIN known_movies k ON k.id = movie_search.rowid
+            WHERE movie_search MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (match, limit * 3))
+        rows = cur.fetchall()
+    except sqlite3.OperationalError:
+        # Index is missing, let TMDB answer
+        rows = []
+
+    # bm25 is lower for better matches, boost well known movies
+    rows.sort(key=lambda row: -row[8] + 0.5 * math.log1p(row[6]) + 0.25 * math.log1p(row[7]), reverse=True)
+    return [SearchResult(
+        id=row[0],
+        title=row[1],
+        original_title=row[2],
+        release_date=row[3] or '',
+        poster_path=row[4],
+        overview=row[5] or '',
+        popularity=row[6],
+        vote_count=row[7],
+    ) for row in rows[:limit]]
+
+
+def fts_match(query):
+    """Returns an FTS5 query matching every word of the query as a prefix, or None for an empty query"""
+    words = query.split()
+    if not words:
+        return None
+    # Quote each word so FTS5 syntax in the query is matched literally
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def catalog_search_page(query, compact=False, overview_chars=None, page=1, page_size=20, max_results=500):
+    """
+        Returns the json bytes for a page of search results from the movie catalog,
+        for when TMDB can't answer a search. Catalog entries only have a title and
+        a popularity, so the results have no poster, release date or overview.
+        The page is marked partial, and has no results if the catalog has no matches.
+    """
+    match = fts_match(query)
+    rows = []
+    try:
+        rows = get_db_connection().execute("""
+            SELECT c.id, c.original_title, c.popularity, bm25(catalog_search)
+            FROM catalog_search JOIN catalog_movies c ON c.id = catalog_search.rowid
+            WHERE catalog_search MATCH ? AND NOT c.adult
+            ORDER BY rank
+            LIMIT ?
+        """, (match, max_results)).fetchall() if match else []
+    except sqlite3.OperationalError:
+        # Index is missing
+        pass
+
+    # Same ranking as the local index, the catalog has no vote counts
+    rows.sort(key=lambda row: -row[3] + 0.5 * math.log1p(row[2]), reverse=True)
+    total_pages = max(math.ceil(len(rows) / page_size), 1)
+    results = [SearchResult(id=row[0], title=row[1], original_title=row[1], popularity=row[2])
+               for row in rows[(page - 1) * page_size:page * page_size]]
+    payload = PartialSearchPage(page=page, results=results, total_pages=total_pages, total_results=len(rows))
+    return encoder.encode(compact_search_payload(payload, overview_chars, PartialCompactSearchPage) if compact else payload)
+
+
+def catalog_titles(movie_ids):
+    """Returns {movie id: title} for the ids found in the movie catalog"""
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+    placeholders = ",".join("?" * len(movie_ids))
+    rows = get_db_connection().execute(f"SELECT id, original_title FROM catalog_movies WHERE id IN ({placeholders})", movie_ids)
+    return dict(rows.fetchall())
+
+
+def index_known_movies(movies):
+    """
+        Adds or updates movies in the local title index.
+        Parameters:
+        - movies (list): MovieDetails or SearchResult models
+    """
+    rows = [(
+        movie.id,
+        movie.title,
+        movie.original_title,
+        movie.release_date,
+        movie.poster_path,
+        movie.overview,
+        movie.popularity,
+        movie.vote_count,
+    ) for movie in movies]
+    if not rows:
+        return
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO known_movies (id, title, original_title, release_date, poster_path, overview, popularity, vote_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            title = excluded.title,
+            original_title = excluded.original_title,
+            release_date = excluded.release_date,
+            poster_path = excluded.poster_path,
+            overview = excluded.overview,
+            popularity = excluded.popularity,
+            vote_count = excluded.vote_count
+    """, rows)
+    conn.commit()
 
 
 def get_movie_info(id):
     """Returns individual movie info based on IMDB id"""
-    response = requests.get(f"https://api.themoviedb.org/3/movie/{id}?api_key={TMDB_API_KEY}&include_adult=false&language=en-US")
-    return response.json()
+    return get_cached_payload(id, "details")
 
 
 def get_movie_release_info(id):
@@ -340,14 +1399,366 @@ def get_movie_release_info(id):
         Get release date info for individual movie based on IMDB id
         Only use US info
     """
-    response = requests.get(f"https://api.themoviedb.org/3/movie/{id}/release_dates?api_key={TMDB_API_KEY}")
-    return response.json()
+    return get_cached_payload(id, "release_dates")
 
 
 def get_cast_info(id):
     """Get the cast list and director for movie"""
-    response = requests.get(f"https://api.themoviedb.org/3/movie/{id}/credits?api_key={TMDB_API_KEY}&include_adult=false&language=en-US")
-    return response.json()
+    return get_cached_payload(id, "credits")
+
+
+def get_movie_details(id):
+    """
+        Returns the movie info, release info and cast info for a movie.
+        Served from the cache when all three are stored, otherwise uses a
+        single call with append_to_response, falling back to making the
+        three calls concurrently if that is turned off or its response
+        doesn't have the appended sections. Returns MOVIE_NOT_FOUND when
+        TMDB has no movie with the id.
+    """
+    cached = read_cached_payloads(id)
+    if len(cached) == len(TMDB_CACHE_TTL):
+        if any(is_stale(payload_type, fetched_at) for payload_type, (_, fetched_at) in cached.items()):
+            schedule_cache_refresh(id)
+        return cached["details"][0], cached["release_dates"][0], cached["credits"][0]
+
+    details = fetch_movie_details(id)
+    if details:
+        return details
+
+    movie_future = submit_timed(tmdb_executor, get_movie_info, id)
+    release_future = submit_timed(tmdb_executor, get_movie_release_info, id)
+    cast_future = submit_timed(tmdb_executor, get_cast_info, id)
+    return movie_future.result(), release_future.result(), cast_future.result()
+
+
+# Returned for the movie info, release info and cast info of a movie TMDB answered 404 for
+MOVIE_NOT_FOUND = (None, None, None)
+
+# Query string parameters for the combined movie details call
+MOVIE_DETAILS_PARAMS = {"append_to_response": "release_dates,credits", "include_adult": "false", "language": "en-US"}
+
+
+def fetch_movie_details(id):
+    """
+        Makes the combined append_to_response call for a movie and stores
+        each part in the cache. Returns the movie info, release info and
+        cast info, MOVIE_NOT_FOUND on a 404 or None if the combined call
+        could not be used.
+        Concurrent fetches for the same movie share one call.
+    """
+    if not TMDB_APPEND_TO_RESPONSE:
+        return None
+    tmdb_breaker.check()
+    return single_flight.do(f"movie_details:{id}", lambda: request_movie_details(id), recheck=lambda: fresh_movie_details(id))
+
+
+def request_movie_details(id):
+    """Makes the combined call for fetch_movie_details"""
+    response = tmdb_client.get("movie_details", f"/movie/{id}", **MOVIE_DETAILS_PARAMS)
+    return handle_movie_details_response(id, response.status_code, response.content)
+
+
+def fresh_movie_details(id):
+    """Returns the movie info, release info and cast info if all three are cached and fresh, otherwise None"""
+    cached = read_cached_payloads(id)
+    if len(cached) < len(TMDB_CACHE_TTL) or any(is_stale(payload_type, fetched_at) for payload_type, (_, fetched_at) in cached.items()):
+        return None
+    return cached["details"][0], cached["release_dates"][0], cached["credits"][0]
+
+
+def handle_movie_details_response(id, status, content):
+    """
+        Decodes and stores a combined movie details response, see fetch_movie_details.
+        Raises requests.HTTPError for error statuses other than 404, the separate
+        calls would fail the same way.
+    """
+    if status == 404:
+        record_missing(id)
+        return MOVIE_NOT_FOUND
+    if status >= 400:
+        raise requests.HTTPError(f"TMDB answered {status} for movie {id}")
+    try:
+        movie = details_with_append_decoder.decode(content)
+    except msgspec.DecodeError:
+        # Response body was not the expected json, use the separate calls instead
+        return None
+    if movie.release_dates is None or movie.credits is None:
+        return None
+
+    movie_info, release_info, cast_info = split_details_with_append(movie)
+    store_cached_payloads(id, {
+        "details": encoder.encode(movie_info),
+        "release_dates": encoder.encode(release_info),
+        "credits": encoder.encode(cast_info),
+    })
+    index_known_movies([movie_info])
+    update_watchlist_movies([movie_info])
+    return movie_info, release_info, cast_info
+
+
+def fetch_payload(id, payload_type):
+    """
+        Makes the TMDB call for a single payload type and stores
+        the payload in the cache if the call was successful.
+        Returns the decoded model, or None if the call failed.
+        Concurrent fetches of the same payload share one call.
+    """
+    tmdb_breaker.check()
+    return single_flight.do(f"payload:{id}:{payload_type}", lambda: request_payload(id, payload_type),
+        recheck=lambda: fresh_cached_payload(id, payload_type))
+
+
+def request_payload(id, payload_type, statuses=None):
+    """Makes the TMDB call for fetch_payload, adding the response status to the statuses list if one is given"""
+    endpoint, path, params = payload_request(id, payload_type)
+    response = tmdb_client.get(endpoint, path, **params)
+    if statuses is not None:
+        statuses.append(response.status_code)
+    return handle_payload_response(id, payload_type, response.status_code, response.content)
+
+
+def fresh_cached_payload(id, payload_type):
+    """Returns the cached payload if it is fresh, otherwise None"""
+    cached = read_cached_payloads(id, payload_type)
+    if payload_type not in cached:
+        return None
+    payload, fetched_at = cached[payload_type]
+    return None if is_stale(payload_type, fetched_at) else payload
+
+
+def payload_request(id, payload_type):
+    """Returns the endpoint name, path and query string parameters of the TMDB call for a payload type"""
+    if payload_type == "details":
+        return "movie", f"/movie/{id}", {"include_adult": "false", "language": "en-US"}
+    if payload_type == "release_dates":
+        return "release_dates", f"/movie/{id}/release_dates", {}
+    return "credits", f"/movie/{id}/credits", {"include_adult": "false", "language": "en-US"}
+
+
+def handle_payload_response(id, payload_type, status, content):
+    """Decodes and stores a single payload response, see fetch_payload"""
+    if status == 404:
+        record_missing(id)
+    if status >= 400:
+        return None
+    try:
+        payload = decode_payload(payload_type, content)
+    except msgspec.DecodeError:
+        return None
+    # Store the decoded model so the cache only keeps the fields we use
+    store_cached_payloads(id, {payload_type: encoder.encode(payload)})
+    if payload_type == "details":
+        index_known_movies([payload])
+        update_watchlist_movies([payload])
+    return payload
+
+
+def get_cached_payload(id, payload_type):
+    """
+        Returns a TMDB payload for the movie from the cache, fetching it on a miss.
+        A stale payload is returned as is and refreshed in the background.
+    """
+    cached = read_cached_payloads(id, payload_type)
+    if payload_type in cached:
+        payload, fetched_at = cached[payload_type]
+        if is_stale(payload_type, fetched_at):
+            schedule_cache_refresh(id, payload_type)
+        return payload
+    return fetch_payload(id, payload_type)
+
+
+def read_cached_payloads(id, payload_type=None):
+    """
+        Returns a dict of payload type to (payload, fetched_at) for the
+        cached TMDB payloads of a movie. Only one type if payload_type is given.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if payload_type:
+        cur.execute("SELECT payload_type, payload, fetched_at FROM tmdb_cache WHERE movie_id = ? AND payload_type = ?", (id, payload_type))
+    else:
+        cur.execute("SELECT payload_type, payload, fetched_at FROM tmdb_cache WHERE movie_id = ?", (id,))
+    rows = cur.fetchall()
+    return {row[0]: (decode_payload(row[0], row[1]), row[2]) for row in rows}
+
+
+def store_cached_payloads(id, payloads):
+    """
+        Saves raw TMDB payloads for a movie to the cache.
+        Parameters:
+        - id (int): movie id
+        - payloads (dict): payload type to json bytes
+    """
+    fetched_at = time.time()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    changed = False
+    for payload_type, payload in payloads.items():
+        # Unchanged payloads only have their fetch time updated
+        cur.execute("UPDATE tmdb_cache SET fetched_at = ? WHERE movie_id = ? AND payload_type = ? AND payload = ?",
+            (fetched_at, id, payload_type, payload))
+        if cur.rowcount < 1:
+            cur.execute("INSERT OR REPLACE INTO tmdb_cache (movie_id, payload_type, payload, fetched_at) VALUES (?, ?, ?, ?)",
+                (id, payload_type, payload, fetched_at))
+            changed = True
+    # Stored movie page info was built from the old payloads
+    if changed:
+        cur.execute("DELETE FROM movie_views WHERE movie_id = ?", (id,))
+    # TMDB answers for the movie again
+    cur.execute("DELETE FROM missing_movies WHERE movie_id = ?", (id,))
+    conn.commit()
+
+
+# Longest a movie TMDB answered 404 for is skipped before it is tried again
+MISSING_MAX_BACKOFF = 60 * 60 * 24 * 30
+
+
+def record_missing(id):
+    """
+        Skips a movie TMDB answered 404 for, for CACHE_WARMER_MISSING_BACKOFF seconds doubled
+        with every 404 in a row. 404s while the movie is already skipped, like the other calls
+        made for the same page, don't extend it. Cleared once a payload is stored for the movie.
+    """
+    conn = get_db_connection()
+    now = time.time()
+    row = conn.execute("SELECT misses, retry_at FROM missing_movies WHERE movie_id = ?", (id,)).fetchone()
+    if row and row[1] > now:
+        return
+    misses = (row[0] if row else 0) + 1
+    retry_at = now + min(CACHE_WARMER_MISSING_BACKOFF * 2 ** (misses - 1), MISSING_MAX_BACKOFF)
+    conn.execute("""
+        INSERT INTO missing_movies (movie_id, misses, retry_at) VALUES (?, ?, ?)
+        ON CONFLICT (movie_id) DO UPDATE SET misses = excluded.misses, retry_at = excluded.retry_at
+    """, (id, misses, retry_at))
+    conn.commit()
+
+
+def backed_off_movies(movie_ids):
+    """Returns the set of movie ids TMDB answered 404 for that aren't due to be tried again"""
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return set()
+    placeholders = ",".join("?" * len(movie_ids))
+    rows = get_db_connection().execute(f"SELECT movie_id FROM missing_movies WHERE movie_id IN ({placeholders}) AND retry_at > ?",
+        (*movie_ids, time.time()))
+    return {row[0] for row in rows}
+
+
+def is_stale(payload_type, fetched_at):
+    """Checks if a cached payload is older than the ttl for its type"""
+    return time.time() - fetched_at > TMDB_CACHE_TTL[payload_type]
+
+
+def schedule_cache_refresh(id, payload_type=None):
+    """
+        Refreshes cached payloads for a movie on the TMDB pool.
+        Does nothing if a refresh for the movie is already queued in this process,
+        or while the TMDB circuit breaker is open and the stale payloads are kept.
+    """
+    if tmdb_breaker.is_open():
+        return
+    with refreshing_lock:
+        if id in refreshing_movies:
+            return
+        refreshing_movies.add(id)
+
+    def refresh():
+        try:
+            if payload_type:
+                fetch_payload(id, payload_type)
+            elif not fetch_movie_details(id):
+                for each_type in TMDB_CACHE_TTL:
+                    fetch_payload(id, each_type)
+        except Exception as e:
+            print(f"Error refreshing cache for movie {id}: {e}")
+        finally:
+            with refreshing_lock:
+                refreshing_movies.discard(id)
+
+    tmdb_executor.submit(refresh)
+
+
+def purge_tmdb_cache(id=None):
+    """
+        Deletes cached TMDB payloads for one movie, or the whole cache
+        if no id is given. Returns the number of rows deleted.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if id is None:
+        cur.execute("DELETE FROM tmdb_cache")
+        deleted = cur.rowcount
+        cur.execute("DELETE FROM movie_views")
+    else:
+        cur.execute("DELETE FROM tmdb_cache WHERE movie_id = ?", (id,))
+        deleted = cur.rowcount
+        cur.execute("DELETE FROM movie_views WHERE movie_id = ?", (id,))
+    conn.commit()
+    return deleted
+
+
+def get_movie_view(id):
+    """
+        Returns the formatted movie page info for a movie, or None if it
+        could not be loaded. Served from movie_views while the cached TMDB
+        payloads it was built from are unchanged and MOVIE_VIEW_VERSION matches,
+        otherwise it is rebuilt with format_movie_info and stored.
+    """
+    view = read_movie_view(id)
+    if view is None:
+        view = store_movie_view(id, *get_movie_details(id))
+    return view
+
+
+def partial_movie_view(id):
+    """
+        Returns movie page info built from whatever is stored locally, for when TMDB
+        can't be reached: any cached payloads, then the local search index, then the
+        movie catalog. Returns None if nothing is stored for the movie.
+    """
+    cached = read_cached_payloads(id)
+    movie_info = cached["details"][0] if "details" in cached else None
+    if movie_info is None:
+        conn = get_db_connection()
+        row = conn.execute("SELECT title, original_title, release_date, poster_path, overview, popularity, vote_count FROM known_movies WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            row = conn.execute("SELECT original_title, original_title, '', NULL, '', popularity, 0 FROM catalog_movies WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return None
+        movie_info = MovieDetails(id=int(id), title=row[0], original_title=row[1], release_date=row[2] or '', poster_path=row[3],
+                                  overview=row[4] or '', popularity=row[5], vote_count=row[6])
+    release_info = cached["release_dates"][0] if "release_dates" in cached else ReleaseDates()
+    cast_info = cached["credits"][0] if "credits" in cached else Credits()
+    return format_movie_info(movie_info, release_info, cast_info)
+
+
+def read_movie_view(id):
+    """Returns the stored movie page info if it is still valid, refreshing stale payloads, otherwise None"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT payload_type, fetched_at FROM tmdb_cache WHERE movie_id = ?", (id,))
+    fetched = dict(cur.fetchall())
+    if len(fetched) < len(TMDB_CACHE_TTL):
+        return None
+    if any(is_stale(payload_type, fetched_at) for payload_type, fetched_at in fetched.items()):
+        schedule_cache_refresh(id)
+    cur.execute("SELECT data FROM movie_views WHERE movie_id = ? AND version = ?", (id, MOVIE_VIEW_VERSION))
+    view = cur.fetchone()
+    return movie_view_decoder.decode(view[0]) if view else None
+
+
+def store_movie_view(id, movie_info, release_info, cast_info):
+    """Formats and stores the movie page info, returns None if any of the payloads is missing"""
+    if movie_info is None or release_info is None or cast_info is None:
+        return None
+    with timed(STEP_DURATION, "format", "format_movie_info"):
+        view = format_movie_info(movie_info, release_info, cast_info)
+    conn = get_db_connection()
+    conn.execute("INSERT OR REPLACE INTO movie_views (movie_id, version, data, built_at) VALUES (?, ?, ?, ?)",
+        (id, MOVIE_VIEW_VERSION, encoder.encode(view), time.time()))
+    conn.commit()
+    return view
 
 
 def format_movie_info(movie_info, release_info, cast_info):
@@ -357,66 +1768,66 @@ def format_movie_info(movie_info, release_info, cast_info):
     facts = []
     genres = []
 
-    us_release_info = next((item for item in release_info["results"] if item["iso_3166_1"] == "US"), None)
+    us_release_info = next((item for item in release_info.results if item.iso_3166_1 == "US"), None)
     if us_release_info:
-        us_data = us_release_info["release_dates"][1] if len(us_release_info["release_dates"]) > 1 else us_release_info["release_dates"][0]
-        year = us_data["release_date"][:4]
-        month = us_data["release_date"][5:7]
-        day = us_data["release_date"][8:10]
-        if us_data.get("certification"):
-            rating = us_data.get("certification")
+        us_data = us_release_info.release_dates[1] if len(us_release_info.release_dates) > 1 else us_release_info.release_dates[0]
+        year = us_data.release_date[:4]
+        month = us_data.release_date[5:7]
+        day = us_data.release_date[8:10]
+        if us_data.certification:
+            rating = us_data.certification
             facts.append(rating)
         release_year = year
         release_date = f"{month}/{day}/{year}"
         facts.append(release_date)
-        country = us_release_info.get("iso_3166_1")
+        country = us_release_info.iso_3166_1
     else:
-        release = movie_info.get("release_date")
+        release = movie_info.release_date or ''
         release_year = release[:4]
         year = release[:4]
         month = release[5:7]
         day = release[8:10]
-        release_date = f"{month}/{day}/{year}"
-        facts.append(release_date)
+        if release:
+            release_date = f"{month}/{day}/{year}"
+            facts.append(release_date)
 
     # Get runtime in hours and minutes
-    minutes = movie_info.get("runtime")
+    minutes = movie_info.runtime or 0
     hours = minutes // 60
     minutes = minutes % 60
     if hours > 0 and minutes > 0:
         runtime_str = f"{hours}h {minutes}m"
     elif hours > 0:
         runtime_str = f"{hours}h"
-    else:
+    elif minutes > 0:
         runtime_str = f"{minutes}m"
-    facts.append(runtime_str)
+    if runtime_str:
+        facts.append(runtime_str)
 
     # Build genres array
-    if movie_info.get("genres"):
-        for genre in movie_info.get("genres"):
-            genres.append(genre.get("name"))
+    for genre in movie_info.genres:
+        genres.append(genre.name)
 
     # Get user vote percentage of movie
-    percentage = int(movie_info.get("vote_average") * 10)
+    percentage = int(movie_info.vote_average * 10)
     circle_fill = int((percentage / 100) * 180)
 
     # Get director
-    crew = cast_info.get("crew")
-    director = next((person for person in crew if person.get("job") and person["job"] == "Director"), None)
+    director = next((person for person in cast_info.crew if person.job == "Director"), None)
 
     return {
-        "title": movie_info.get("original_title", ''),
-        "id": movie_info.get("id", ''),
-        "poster": movie_info.get("poster_path", None),
+        "title": movie_info.original_title or '',
+        "id": movie_info.id,
+        "poster": movie_info.poster_path,
         "genres": genres if genres else '',
         "facts": facts,
         "percentage": percentage,
-        "vote_count": movie_info.get("vote_count"),
+        "vote_count": movie_info.vote_count,
         "circle_fill": circle_fill if circle_fill else 0,
         "release_year": release_year if release_year else '',
         "country": country if country else '',
-        "tagline": movie_info.get("tagline", ''),
-        "overview": movie_info.get("overview", ''),
-        "director": director.get("name", "Not listed") if director else "Not listed",
-        "cast_list": cast_info.get("cast"),
+        "tagline": movie_info.tagline or '',
+        "overview": movie_info.overview or '',
+        "director": director.name or "Not listed" if director else "Not listed",
+        "cast_list": cast_info.cast,
     }
\ No newline at end of file
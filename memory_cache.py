@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import threading, time
+
+class ByteLRUCache:
+    """
+        In-process cache of bytes values limited by their total size.
+        Least recently used entries are evicted once max_bytes is reached
+        and entries older than ttl seconds are treated as missing.
+        Each entry keeps the time it was stored, which version() returns.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for the key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches the value, evicting the least recently used entries to make room"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, time.time())
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def version(self, key):
+        """
+            Returns (stored_at, size) for the key's entry, or None if there is no fresh one.
+            Doesn't count as a hit or miss or mark the entry as recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            return entry[2], len(entry[0])
+
+    def _remove(self, key):
+        """Removes an entry, lock must be held"""
+        value, _, _ = self._entries.pop(key)
+        self.size -= len(value)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Returns the counters and current size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.size,
+            }
@@ -0,0 +1,307 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from external_variables import METRICS_BUCKETS, METRICS_ENABLED
+from flask import request
+import bisect, sqlite3, threading, time
+
+class Histogram:
+    """
+        Prometheus style latency histogram, keeping bucket counts and a sum
+        for each combination of label values it has seen.
+    """
+
+    def __init__(self, name, help, labels, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        """Counts one observation in the bucket it falls in"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One count per bucket, one for +Inf, then the sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self):
+        """Returns the histogram in the Prometheus text format"""
+        with self._lock:
+            all_series = sorted((label_values, list(series)) for label_values, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in all_series:
+            labels = format_labels(self.labels, label_values)
+            count = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                count += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {count}')
+            count += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {count}')
+            labels = labels.rstrip(",")
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    """Prometheus style counter for each combination of label values it has seen"""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        """Adds one to the count for the label values"""
+        with self._lock:
+            self._counts[label_values] = self._counts.get(label_values, 0) + 1
+
+    def render(self):
+        """Returns the counter in the Prometheus text format"""
+        with self._lock:
+            counts = sorted(self._counts.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, count in counts:
+            labels = format_labels(self.labels, label_values).rstrip(",")
+            lines.append(f"{self.name}{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Gauge:
+    """Prometheus style gauge holding the last value set for each combination of label values"""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        """Sets the value for the label values"""
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        """Returns the gauge in the Prometheus text format"""
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in values:
+            labels = format_labels(self.labels, label_values).rstrip(",")
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class CacheStats:
+    """
+        Exports the counters of in-process caches, read from the stats() of
+        each registered cache when the metrics are rendered.
+    """
+
+    # Metric name suffix, stats() key, Prometheus type and help of each series
+    SERIES = (
+        ("hits_total", "hits", "counter", "Lookups answered from the cache"),
+        ("misses_total", "misses", "counter", "Lookups that found no fresh entry"),
+        ("evictions_total", "evictions", "counter", "Entries evicted to stay under the size limit"),
+        ("entries", "entries", "gauge", "Entries held in the cache"),
+        ("bytes", "bytes", "gauge", "Total size of the values held in the cache"),
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self._caches = {}
+
+    def register(self, cache_name, cache):
+        """Adds a cache to the exported ones, labeled with cache_name"""
+        self._caches[cache_name] = cache
+
+    def render(self):
+        """Returns the counters of every registered cache in the Prometheus text format"""
+        all_stats = sorted((cache_name, cache.stats()) for cache_name, cache in self._caches.items())
+        lines = []
+        for suffix, key, kind, help in self.SERIES:
+            lines += [f"# HELP {self.name}_{suffix} {help}", f"# TYPE {self.name}_{suffix} {kind}"]
+            for cache_name, stats in all_stats:
+                lines.append(f'{self.name}_{suffix}{{cache="{escape_label(cache_name)}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(names, values):
+    """Returns the label pairs for a series, each followed by a comma"""
+    return "".join(f'{name}="{escape_label(value)}",' for name, value in zip(names, values))
+
+
+def escape_label(value):
+    """Escapes a label value for the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram("movielist_request_duration_seconds", "Time to build each response, by route", ("route", "method", "status"))
+UPSTREAM_DURATION = Histogram("movielist_upstream_duration_seconds", "TMDB call latency including retries, by endpoint", ("client", "endpoint", "outcome"))
+DB_QUERY_DURATION = Histogram("movielist_db_query_duration_seconds", "SQLite statement execution time, by statement type", ("operation",))
+TEMPLATE_DURATION = Histogram("movielist_template_render_duration_seconds", "Jinja rendering time, by template", ("template",))
+STEP_DURATION = Histogram("movielist_step_duration_seconds", "Time spent in other instrumented steps", ("step",))
+HASH_WAIT = Histogram("movielist_password_hash_queue_wait_seconds", "Time password hashing jobs waited for a queue slot and a worker, by job and whether a slot freed up", ("job", "outcome"))
+COALESCED_FETCHES = Counter("movielist_coalesced_fetches_total", "TMDB fetches by whether the caller made the call, shared another caller's or found it cached after waiting", ("outcome",))
+BREAKER_STATE = Gauge("movielist_circuit_breaker_state", "Upstream circuit breaker state, 0 closed, 1 half open, 2 open", ("breaker",))
+BREAKER_REJECTED = Counter("movielist_circuit_breaker_rejected_total", "Upstream calls not made because the circuit breaker was open", ("breaker",))
+WARMED_PAYLOADS = Counter("movielist_cache_warmer_payloads_total", "Cached TMDB payloads the cache warmer refreshed, failed to refresh or found missing on TMDB", ("outcome",))
+WARMER_DUE = Gauge("movielist_cache_warmer_due_payloads", "Payloads of the most saved movies still due for a refresh after the last cache warmer run", ())
+MEMORY_CACHES = CacheStats("movielist_memory_cache")
+METRICS = (REQUEST_DURATION, UPSTREAM_DURATION, DB_QUERY_DURATION, TEMPLATE_DURATION, STEP_DURATION, HASH_WAIT, COALESCED_FETCHES, BREAKER_STATE, BREAKER_REJECTED, WARMED_PAYLOADS, WARMER_DUE, MEMORY_CACHES)
+
+
+class RequestTimings:
+    """
+        Time spent on each kind of work while handling one request, sent back
+        in the Server-Timing header. Work done concurrently on other threads
+        is added up, so the parts can add up to more than the total.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Adds seconds to the total for name"""
+        with self._lock:
+            total = self._totals.get(name)
+            if total is None:
+                self._totals[name] = [seconds, 1]
+            else:
+                total[0] += seconds
+                total[1] += 1
+
+    def header(self, elapsed):
+        """Returns the Server-Timing header value, with elapsed seconds as the total"""
+        with self._lock:
+            totals = sorted(self._totals.items())
+        parts = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"' for name, (seconds, count) in totals]
+        parts.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Timings of the request being handled, None outside of a request
+current_timings = ContextVar("current_timings", default=None)
+
+# Start time of the template being rendered in this context
+render_started = ContextVar("render_started", default=None)
+
+
+def observe(histogram, timing_name, seconds, *label_values):
+    """Records seconds in the histogram and adds them to the current request's timings"""
+    if not METRICS_ENABLED:
+        return
+    histogram.observe(seconds, *label_values)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(timing_name, seconds)
+
+
+@contextmanager
+def timed(histogram, timing_name, *label_values):
+    """Times the block, see observe"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(histogram, timing_name, time.perf_counter() - start, *label_values)
+
+
+def submit_timed(executor, fn, *args):
+    """
+        Submits fn to the executor so its database queries and TMDB calls
+        count towards the current request's timings.
+    """
+    return executor.submit(run_with_timings, current_timings.get(), fn, *args)
+
+
+def run_with_timings(timings, fn, *args):
+    """Runs fn with timings as the current request timings"""
+    token = current_timings.set(timings)
+    try:
+        return fn(*args)
+    finally:
+        current_timings.reset(token)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times every statement it executes"""
+
+    def execute(self, sql, parameters=()):
+        with timed(DB_QUERY_DURATION, "db", sql_operation(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with timed(DB_QUERY_DURATION, "db", sql_operation(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with timed(DB_QUERY_DURATION, "db", "script"):
+            return super().executescript(sql_script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+        Connection whose cursors are TimedCursors. The execute shortcuts run their
+        statement without a Python cursor, so they go through a TimedCursor here.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def sql_operation(sql):
+    """Returns the statement type of a query in lower case, ex: select"""
+    return sql.lstrip().split(None, 1)[0].lower()
+
+
+def start_request_timing():
+    """Starts timing the request, registered as the first before_request hook"""
+    current_timings.set(RequestTimings())
+
+
+def finish_request_timing(response):
+    """Records the request duration and adds the Server-Timing header, registered as an after_request hook"""
+    timings = current_timings.get()
+    if timings is None:
+        return response
+    elapsed = time.perf_counter() - timings.start
+    REQUEST_DURATION.observe(elapsed, request.endpoint or "unmatched", request.method, str(response.status_code))
+    response.headers["Server-Timing"] = timings.header(elapsed)
+    return response
+
+
+def start_template_timing(sender, template, context, **extra):
+    """Connected to the before_render_template signal"""
+    render_started.set(time.perf_counter())
+
+
+def finish_template_timing(sender, template, context, **extra):
+    """Connected to the template_rendered signal"""
+    start = render_started.get()
+    if start is not None:
+        observe(TEMPLATE_DURATION, "template", time.perf_counter() - start, template.name)
+
+
+def render_metrics():
+    """Returns every metric in the Prometheus text format"""
+    return "".join(metric.render() for metric in METRICS)
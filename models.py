@@ -0,0 +1,170 @@
+from typing import Optional, Union
+import msgspec
+
+# Typed TMDB payloads. Only the fields the app reads are declared,
+# every other field in a TMDB response is skipped while decoding.
+
+class Genre(msgspec.Struct):
+    id: int = 0
+    name: str = ''
+
+
+class MovieDetails(msgspec.Struct):
+    id: int
+    title: Optional[str] = ''
+    original_title: Optional[str] = ''
+    release_date: Optional[str] = ''
+    runtime: Optional[int] = None
+    genres: list[Genre] = msgspec.field(default_factory=list)
+    vote_average: float = 0.0
+    vote_count: int = 0
+    popularity: float = 0.0
+    poster_path: Optional[str] = None
+    tagline: Optional[str] = ''
+    overview: Optional[str] = ''
+
+
+class ReleaseDate(msgspec.Struct):
+    certification: Optional[str] = ''
+    release_date: str = ''
+
+
+class CountryRelease(msgspec.Struct):
+    iso_3166_1: str
+    release_dates: list[ReleaseDate] = msgspec.field(default_factory=list)
+
+
+class ReleaseDates(msgspec.Struct):
+    id: int = 0
+    results: list[CountryRelease] = msgspec.field(default_factory=list)
+
+
+class CastMember(msgspec.Struct):
+    name: str = ''
+    character: Optional[str] = ''
+    profile_path: Optional[str] = None
+
+
+class CrewMember(msgspec.Struct):
+    name: str = ''
+    job: Optional[str] = ''
+
+
+class Credits(msgspec.Struct):
+    id: int = 0
+    cast: list[CastMember] = msgspec.field(default_factory=list)
+    crew: list[CrewMember] = msgspec.field(default_factory=list)
+
+
+class MovieDetailsWithAppend(MovieDetails):
+    """Movie details from a call using append_to_response=release_dates,credits"""
+    release_dates: Optional[ReleaseDates] = None
+    credits: Optional[Credits] = None
+
+
+class SearchResult(msgspec.Struct):
+    id: int
+    title: Optional[str] = ''
+    original_title: Optional[str] = ''
+    release_date: Optional[str] = ''
+    poster_path: Optional[str] = None
+    overview: Optional[str] = ''
+    popularity: float = 0.0
+    vote_count: int = 0
+
+
+class SearchPage(msgspec.Struct):
+    page: int = 1
+    results: list[SearchResult] = msgspec.field(default_factory=list)
+    total_pages: int = 1
+    total_results: int = 0
+
+
+class CompactSearchResult(msgspec.Struct):
+    """Only the search result fields the client reads"""
+    id: int
+    original_title: Optional[str]
+    release_date: Optional[str]
+    poster_path: Optional[str]
+    overview: Optional[str]
+
+
+class CompactSearchPage(msgspec.Struct):
+    page: int
+    results: list[CompactSearchResult]
+    total_pages: int
+    total_results: int
+
+
+class CatalogEntry(msgspec.Struct):
+    """One line of the TMDB daily movie id export"""
+    id: int
+    original_title: Optional[str] = ''
+    popularity: float = 0.0
+    adult: bool = False
+    video: bool = False
+
+
+class PartialSearchPage(SearchPage):
+    """Search page answered from the local movie catalog because TMDB couldn't be reached"""
+    partial: bool = True
+
+
+class PartialCompactSearchPage(CompactSearchPage):
+    """Compact search page answered from the local movie catalog, see PartialSearchPage"""
+    partial: bool = True
+
+
+class MovieView(msgspec.Struct):
+    """Formatted movie page info built by format_movie_info"""
+    title: str
+    id: int
+    poster: Optional[str]
+    genres: Union[list[str], str]
+    facts: list[str]
+    percentage: int
+    vote_count: int
+    circle_fill: int
+    release_year: str
+    country: str
+    tagline: str
+    overview: str
+    director: str
+    cast_list: list[CastMember]
+
+
+# Decoders for each cached payload type, built once and reused
+PAYLOAD_DECODERS = {
+    "details": msgspec.json.Decoder(MovieDetails),
+    "release_dates": msgspec.json.Decoder(ReleaseDates),
+    "credits": msgspec.json.Decoder(Credits),
+}
+details_with_append_decoder = msgspec.json.Decoder(MovieDetailsWithAppend)
+search_page_decoder = msgspec.json.Decoder(SearchPage)
+movie_view_decoder = msgspec.json.Decoder(MovieView)
+catalog_entry_decoder = msgspec.json.Decoder(CatalogEntry)
+encoder = msgspec.json.Encoder()
+
+
+def decode_payload(payload_type, content):
+    """
+        Decodes TMDB json bytes into the model for the payload type.
+        Credits only keep directors from the crew, the rest is never shown.
+    """
+    payload = PAYLOAD_DECODERS[payload_type].decode(content)
+    if payload_type == "credits":
+        only_directors(payload)
+    return payload
+
+
+def only_directors(credits):
+    """Drops every crew member that isn't a director"""
+    credits.crew = [person for person in credits.crew if person.job == "Director"]
+    return credits
+
+
+def split_details_with_append(movie):
+    """Splits a MovieDetailsWithAppend into movie details, release dates and credits"""
+    details = MovieDetails(**{field: getattr(movie, field) for field in MovieDetails.__struct_fields__})
+    movie.release_dates.id = movie.credits.id = movie.id
+    return details, movie.release_dates, only_directors(movie.credits)
@@ -0,0 +1,124 @@
+from external_variables import OUTBOX_BACKOFF, OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_TIMEOUT, OUTBOX_MAX_ATTEMPTS, OUTBOX_POLL_INTERVAL
+from flask_mail import Message
+from helpers import get_db_connection
+import threading, time
+
+# Set when an email is queued so the worker in this process sends it right away
+outbox_wakeup = threading.Event()
+
+
+def queue_email(recipient, subject, body):
+    """
+        Writes an email to the outbox to be sent by the outbox worker.
+        Returns once the outbox row is committed.
+    """
+    conn = get_db_connection()
+    now = time.time()
+    conn.execute("""
+        INSERT INTO email_outbox (recipient, subject, body, status, attempts, next_attempt_at, created_at)
+        VALUES (?, ?, ?, 'pending', 0, ?, ?)
+    """, (recipient, subject, body, now, now))
+    conn.commit()
+    outbox_wakeup.set()
+
+
+def claim_emails(limit=OUTBOX_BATCH_SIZE):
+    """
+        Marks due outbox emails as sending and returns them.
+        Emails left sending by a worker that died are claimed again
+        once OUTBOX_CLAIM_TIMEOUT seconds have passed.
+    """
+    conn = get_db_connection()
+    now = time.time()
+    rows = conn.execute("""
+        UPDATE email_outbox SET status = 'sending', claimed_at = ?
+        WHERE id IN (
+            SELECT id FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+                OR (status = 'sending' AND claimed_at < ?)
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id, recipient, subject, body, attempts
+    """, (now, now, now - OUTBOX_CLAIM_TIMEOUT, limit)).fetchall()
+    conn.commit()
+    return rows
+
+
+def mark_sent(email_id):
+    """Records that an outbox email was delivered"""
+    conn = get_db_connection()
+    conn.execute("UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL WHERE id = ?", (time.time(), email_id))
+    conn.commit()
+
+
+def mark_failed(email_id, attempts, error):
+    """
+        Records a failed delivery. The email is retried with exponential
+        backoff until it has failed OUTBOX_MAX_ATTEMPTS times.
+    """
+    attempts += 1
+    status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+    next_attempt_at = time.time() + OUTBOX_BACKOFF * 2 ** (attempts - 1)
+    conn = get_db_connection()
+    conn.execute("UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+        (status, attempts, next_attempt_at, str(error), email_id))
+    conn.commit()
+
+
+class OutboxWorker:
+    """
+        Background thread that sends outbox emails.
+        One SMTP connection is kept open while there are emails to send
+        and reopened after a failed delivery.
+    """
+
+    def __init__(self, app, mail, sender):
+        self.app = app
+        self.mail = mail
+        self.sender = sender
+        self.connection = None
+
+    def start(self):
+        """Starts the worker on a daemon thread"""
+        threading.Thread(target=self.run_forever, name="email-outbox", daemon=True).start()
+
+    def run_forever(self):
+        """Sends due emails, then waits to be woken up or for the next poll"""
+        with self.app.app_context():
+            while True:
+                try:
+                    sent = self.send_due()
+                except Exception as e:
+                    print(f"Error sending outbox emails: {e}")
+                    sent = 0
+                if not sent:
+                    self.close()
+                    outbox_wakeup.wait(OUTBOX_POLL_INTERVAL)
+                    outbox_wakeup.clear()
+
+    def send_due(self):
+        """Sends one batch of due emails, returns how many were claimed"""
+        emails = claim_emails()
+        for email_id, recipient, subject, body, attempts in emails:
+            msg = Message(subject, sender=self.sender, recipients=[recipient], body=body)
+            try:
+                if self.connection is None:
+                    self.connection = self.mail.connect()
+                    self.connection.__enter__()
+                self.connection.send(msg)
+            except Exception as e:
+                self.close()
+                mark_failed(email_id, attempts, e)
+            else:
+                mark_sent(email_id)
+        return len(emails)
+
+    def close(self):
+        """Closes the SMTP connection if one is open"""
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self.connection = None
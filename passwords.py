@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+from external_variables import HASH_QUEUE_SIZE, HASH_QUEUE_TIMEOUT, HASH_WORKERS, PASSWORD_HASH_METHOD
+from metrics import HASH_WAIT, observe
+from werkzeug.security import check_password_hash, generate_password_hash
+import multiprocessing, threading, time
+
+class HashQueueFull(Exception):
+    """Raised when the password hashing queue has no free slot"""
+
+
+# Process pool is created on first use so importing this module stays cheap
+hash_executor = None
+executor_lock = threading.Lock()
+
+# Limits hashing jobs submitted or running at once
+hash_slots = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
+
+def get_hash_executor():
+    """Returns the process pool for hashing jobs, creating it on first use"""
+    global hash_executor
+    with executor_lock:
+        if hash_executor is None:
+            hash_executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return hash_executor
+
+
+def _generate(password, method, submitted_at):
+    """Runs in a worker process, returns the hash and the seconds since the job was queued"""
+    return generate_password_hash(password, method=method, salt_length=16), time.time() - submitted_at
+
+
+def _check(pw_hash, password, submitted_at):
+    """Runs in a worker process, returns if the password matches and the seconds since the job was queued"""
+    return check_password_hash(pw_hash, password), time.time() - submitted_at
+
+
+def run_hash_job(job, *args):
+    """
+        Runs a hashing job on the process pool and waits for its result.
+        Raises HashQueueFull if no queue slot frees up within HASH_QUEUE_TIMEOUT seconds.
+        The time until a worker picked the job up, waiting for a queue slot included,
+        is recorded in the hash queue wait histogram.
+    """
+    job_name = job.__name__.lstrip("_")
+    queued_at = time.time()
+    if not hash_slots.acquire(timeout=HASH_QUEUE_TIMEOUT):
+        observe(HASH_WAIT, "hash-wait", time.time() - queued_at, job_name, "full")
+        raise HashQueueFull()
+    try:
+        result, waited = get_hash_executor().submit(job, *args, queued_at).result()
+    finally:
+        hash_slots.release()
+
+    observe(HASH_WAIT, "hash-wait", waited, job_name, "ok")
+    return result
+
+
+def hash_password(password):
+    """Returns a hash of the password using the configured pbkdf2 cost"""
+    return run_hash_job(_generate, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(pw_hash, password):
+    """Checks the password against a stored hash"""
+    return run_hash_job(_check, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """Checks if a stored hash was made with different parameters than the current config"""
+    return pw_hash.split("$", 1)[0] != PASSWORD_HASH_METHOD
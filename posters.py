@@ -0,0 +1,105 @@
+from external_variables import POSTER_CACHE_DIR, POSTER_CACHE_MAX_BYTES, POSTER_SIZES, TMDB_IMAGE_BASE_URL
+from circuit_breaker import CircuitBreaker
+from tmdb import TMDB_ERRORS, TMDBClient
+import hashlib, os, re, tempfile, threading
+
+# TMDB image file names, anything else is never fetched
+POSTER_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+\.(jpg|jpeg|png|webp)$")
+
+class PosterCache:
+    """
+        Disk cache of TMDB images sharded by a hash of the file name.
+        Each image is fetched from the image origin once. When the cache grows
+        past max_bytes the least recently used files are deleted until it is
+        back under 90% of the budget.
+    """
+
+    def __init__(self, directory=POSTER_CACHE_DIR, max_bytes=POSTER_CACHE_MAX_BYTES, client=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # The image origin gets its own breaker, its failures shouldn't stop api calls or the other way round
+        self.client = client or TMDBClient(base_url=TMDB_IMAGE_BASE_URL, api_key=None, breaker=CircuitBreaker("poster"))
+        self.size = None
+        self._lock = threading.Lock()
+
+    def path_for(self, size, name):
+        """Returns the cache file path for an image size and file name"""
+        digest = hashlib.sha1(f"{size}/{name}".encode()).hexdigest()
+        return os.path.join(self.directory, size, digest[:2], digest[2:4], name)
+
+    def get(self, size, name):
+        """
+            Returns the path of the cached image, fetching it on a miss.
+            Returns None for unknown sizes, bad names, images the origin doesn't have
+            and images it failed to fetch, including while the poster breaker is open.
+        """
+        if size not in POSTER_SIZES or not POSTER_NAME_PATTERN.match(name):
+            return None
+        path = self.path_for(size, name)
+        try:
+            # Touch the file so eviction sees it as recently used
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        try:
+            response = self.client.get("poster", f"/{size}/{name}")
+        except TMDB_ERRORS as e:
+            print(f"Error fetching poster {size}/{name}: {e}")
+            return None
+        if not response.ok:
+            return None
+        self.store(path, response.content)
+        return path
+
+    def store(self, path, content):
+        """Writes an image to the cache, replacing the file atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self.size is None:
+                self.size = self.disk_usage()
+            else:
+                self.size += len(content)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def cached_files(self):
+        """Returns (last used, size, path) for every cached image"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def disk_usage(self):
+        """Returns the total size of the cached images"""
+        return sum(size for _, size, _ in self.cached_files())
+
+    def evict(self):
+        """Deletes least recently used images until the cache is under 90% of its budget, lock must be held"""
+        files = sorted(self.cached_files())
+        self.size = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+# One poster cache per worker process, all sharing the same directory
+poster_cache = PosterCache()
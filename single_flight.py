@@ -0,0 +1,166 @@
+from concurrent.futures import CancelledError, Future
+from external_variables import SINGLE_FLIGHT_LOCK_DIR, SINGLE_FLIGHT_LOCK_STRIPES
+from metrics import COALESCED_FETCHES
+import asyncio, hashlib, os, threading
+
+# File locks are only available on Unix, elsewhere fetches are only shared between threads
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds an async caller waits between tries for a lock file held by another process
+ASYNC_LOCK_POLL_INTERVAL = 0.01
+
+class SingleFlight:
+    """
+        Coalesces concurrent calls for the same key into one call.
+        The first caller for a key runs it and every caller that arrives
+        while it is running gets the same result, or the same exception.
+
+        Calls made with a recheck function are also serialized across
+        worker processes on the host with a lock file. A caller that had to
+        wait for the lock calls recheck first, so a result another process
+        stored in the shared database while it waited is used instead of
+        making the call again.
+    """
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_LOCK_DIR, stripes=SINGLE_FLIGHT_LOCK_STRIPES):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self._calls = {}
+        self._lock = threading.Lock()
+        if fcntl is not None:
+            try:
+                os.makedirs(lock_dir, exist_ok=True)
+            except OSError:
+                self.lock_dir = None
+        else:
+            self.lock_dir = None
+
+    def do(self, key, fn, recheck=None):
+        """
+            Returns fn(), sharing the call with any concurrent caller for the key.
+            Parameters:
+            - key (str): identifies the resource, ex: payload:550:details
+            - fn (callable): makes the call
+            - recheck (callable): returns the stored result or None, see the class docstring
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                result = future.result()
+            except CancelledError:
+                # The caller running it gave up, try again
+                continue
+            COALESCED_FETCHES.inc("shared")
+            return result
+
+        try:
+            lock = self._lock_file(key) if recheck else None
+            try:
+                if lock is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                result = self._recheck(recheck)
+                if result is None:
+                    COALESCED_FETCHES.inc("fetched")
+                    result = fn()
+            finally:
+                if lock is not None:
+                    os.close(lock)
+        except BaseException as error:
+            self._finish(key, future, error=error)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key, fn, recheck=None):
+        """Awaits fn(), sharing the call with any concurrent caller for the key, see do"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # Shielded so this caller being cancelled doesn't cancel the shared call
+                result = await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            COALESCED_FETCHES.inc("shared")
+            return result
+
+        try:
+            lock = self._lock_file(key) if recheck else None
+            try:
+                if lock is not None:
+                    # Polled so the event loop isn't blocked while another process holds it
+                    while not self._try_flock(lock):
+                        await asyncio.sleep(ASYNC_LOCK_POLL_INTERVAL)
+                result = self._recheck(recheck)
+                if result is None:
+                    COALESCED_FETCHES.inc("fetched")
+                    result = await fn()
+            finally:
+                if lock is not None:
+                    os.close(lock)
+        except BaseException as error:
+            self._finish(key, future, error=error)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def _join(self, key):
+        """Returns the future for the key's call and whether this caller has to run it"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        """Hands the result or exception of the key's call to every caller waiting on it"""
+        with self._lock:
+            del self._calls[key]
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Cancelled or interrupted, waiting callers retry instead of failing
+            future.cancel()
+
+    def _recheck(self, recheck):
+        """Returns the result recheck found stored, or None"""
+        if recheck is None:
+            return None
+        result = recheck()
+        if result is not None:
+            COALESCED_FETCHES.inc("rechecked")
+        return result
+
+    def _lock_file(self, key):
+        """Opens the lock file for the key, returns None if lock files can't be used"""
+        if self.lock_dir is None:
+            return None
+        # Keys are spread over a fixed number of files so they never pile up
+        stripe = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=4).digest(), "big") % self.stripes
+        try:
+            return os.open(os.path.join(self.lock_dir, f"{stripe}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return None
+
+    def _try_flock(self, lock):
+        """Takes the lock file without waiting, returns if it was taken"""
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+
+# One coalescing table per worker process, shared by all helpers
+single_flight = SingleFlight()
@@ -0,0 +1,107 @@
+from datetime import timedelta
+from external_variables import FLASH_KEY, FLASH_SESSION_LIFETIME, SESSION_REFRESH_INTERVAL, SESSION_SWEEP_INTERVAL
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+from helpers import get_db_connection
+import threading, time
+
+# Session keys that only exist to show a flash message
+FLASH_ONLY_KEYS = {"_flashes", FLASH_KEY}
+
+
+class SqliteSession(ServerSideSession):
+    """Server side session that remembers when its stored row expires"""
+
+    def __init__(self, initial=None, sid=None, permanent=None, stored_expiry=None):
+        super().__init__(initial, sid=sid, permanent=permanent)
+        self.stored_expiry = stored_expiry
+
+
+class SqliteSessionInterface(ServerSideSessionInterface):
+    """
+        Stores sessions in the sessions table of the app database.
+        Expired rows are found with an index on expiry and deleted by a
+        background sweep, which the app starts with start_sweeper. Unchanged sessions are only rewritten once every
+        SESSION_REFRESH_INTERVAL seconds, and sessions that only hold a flash
+        message get a short lifetime and are dropped once the flash is read.
+    """
+
+    session_class = SqliteSession
+    ttl = False
+
+    def __init__(self, app, sweep_interval=SESSION_SWEEP_INTERVAL, **kwargs):
+        super().__init__(app, cleanup_n_requests=None, **kwargs)
+        self.sweep_interval = sweep_interval
+        # Expiry of the row read by the current thread's open_session
+        self._loaded = threading.local()
+
+    def start_sweeper(self):
+        """Starts the expired session sweep on a daemon thread, unless sweep_interval is 0"""
+        if self.sweep_interval:
+            threading.Thread(target=self._sweep_forever, name="session-sweep", daemon=True).start()
+
+    def open_session(self, app, request):
+        """Loads the session, keeping the expiry of its stored row"""
+        self._loaded.expiry = None
+        session = super().open_session(app, request)
+        session.stored_expiry = self._loaded.expiry if session else None
+        return session
+
+    def save_session(self, app, session, response):
+        """Treats sessions left with only an already read flash as empty"""
+        if session and "_flashes" not in session and is_flash_only(session):
+            session.clear()
+        return super().save_session(app, session, response)
+
+    def should_set_storage(self, app, session):
+        """Writes modified sessions, refreshes unchanged ones at most every SESSION_REFRESH_INTERVAL"""
+        if session.modified:
+            return True
+        if not app.config["SESSION_REFRESH_EACH_REQUEST"] or is_flash_only(session) or session.stored_expiry is None:
+            return False
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        return session.stored_expiry - time.time() < lifetime - SESSION_REFRESH_INTERVAL
+
+    def _retrieve_session_data(self, store_id):
+        cur = get_db_connection().cursor()
+        cur.execute("SELECT data, expiry FROM sessions WHERE id = ? AND expiry > ?", (store_id, time.time()))
+        row = cur.fetchone()
+        if not row:
+            return None
+        self._loaded.expiry = row[1]
+        return self.serializer.decode(row[0])
+
+    def _delete_session(self, store_id):
+        conn = get_db_connection()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (store_id,))
+        conn.commit()
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        if is_flash_only(session):
+            session_lifetime = timedelta(seconds=FLASH_SESSION_LIFETIME)
+        expiry = time.time() + session_lifetime.total_seconds()
+        conn = get_db_connection()
+        conn.execute("INSERT OR REPLACE INTO sessions (id, data, expiry) VALUES (?, ?, ?)",
+            (store_id, self.serializer.encode(session), expiry))
+        conn.commit()
+        session.stored_expiry = expiry
+
+    def _delete_expired_sessions(self):
+        """Deletes every expired session, returns how many were deleted"""
+        conn = get_db_connection()
+        cur = conn.execute("DELETE FROM sessions WHERE expiry <= ?", (time.time(),))
+        conn.commit()
+        return cur.rowcount
+
+    def _sweep_forever(self):
+        """Runs on a daemon thread, deleting expired sessions every sweep_interval seconds"""
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self._delete_expired_sessions()
+            except Exception as e:
+                print(f"Error sweeping expired sessions: {e}")
+
+
+def is_flash_only(session):
+    """Checks if a session holds nothing but flash message data"""
+    return set(session.keys()) <= FLASH_ONLY_KEYS
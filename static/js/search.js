@@ -13,22 +13,36 @@ unfocused. If when it's focused again and its value is the same as this value,
 no need to recall api */
 let searchedValue = null;
 
+/* Paging state for the search results page, more pages are loaded on scroll */
+const searchPageState = { page: 1, totalPages: 1, loading: false };
+
 /**
  * Fetch search results by similar movie title
  * @param query the string that is searched for
  * @param parentContainer the parent html element the results will be appended to
+ * @param page the page of results to fetch, pages after the first are appended
  */
-const fetchSearchResult = (query, parentContainer) => {
-    fetch(`/search-results?q=${encodeURIComponent(query)}`)
+const fetchSearchResult = (query, parentContainer, page = 1) => {
+    // The search bar only shows the first page, so it can be answered from the local title index
+    const local = parentContainer === searchPageWrapper ? 0 : 1;
+    return fetch(`/search-results?q=${encodeURIComponent(query)}&compact=1&overview=300&page=${page}&local=${local}`)
     .then(response => { if (response.ok) return response.json(); })
     .then(data => {
+        if (parentContainer === searchPageWrapper) {
+            searchPageState.page = page;
+            searchPageState.totalPages = data.total_pages || 1;
+        }
         let results;
         if (data.results.length) {
             results = data.results;
+        } else if (page > 1) {
+            return;
+        } else if (data.partial) {
+            results = { Error: "Search is unavailable right now, please try again in a moment." };
         } else {
             results = { Error: `Could not find the movie '${query}'`, };
         }
-        buildSearchBarResults(results, parentContainer);
+        buildSearchBarResults(results, parentContainer, page > 1, data.partial);
     })
     .catch(error => {
         console.log(error);
@@ -39,9 +53,20 @@ const fetchSearchResult = (query, parentContainer) => {
  * Builds the search bar results
  * @param results the reults from fetch call to OMDB
  * @param parentContainer the parent html element the results will be appended to
+ * @param append add the results after the ones already shown instead of replacing them
+ * @param partial the results came from the offline catalog because TMDB isn't responding
  */
-const buildSearchBarResults = async (results, parentContainer) => {
-    clearSearchResults();
+const buildSearchBarResults = async (results, parentContainer, append = false, partial = false) => {
+    if (append) {
+        // Previous last result is no longer the bottom of the list
+        const lastResult = parentContainer.lastElementChild;
+        if (lastResult) {
+            lastResult.classList.remove("rounded", "rounded-bottom");
+            lastResult.classList.add("border-bottom");
+        }
+    } else {
+        clearSearchResults();
+    }
     parentContainer.classList.contains("d-none") ? parentContainer.classList.remove("d-none") : null;
 
     // Start build of search result elements
@@ -51,6 +76,12 @@ const buildSearchBarResults = async (results, parentContainer) => {
         p.classList.add("mb-0", "px-2", "py-3", "search-result", "rounded");
         parentContainer.append(p);
     } else {
+        if (partial && !append) {
+            const notice = document.createElement('p');
+            notice.textContent = "TMDB isn't responding, showing titles only.";
+            notice.classList.add("mb-0", "px-2", "py-2", "search-result", "border-bottom", "opacity-50");
+            parentContainer.append(notice);
+        }
         results.forEach((movie, index) => {
             const movieLink = document.createElement("a");
             const leftContainer = document.createElement("div");
@@ -62,9 +93,9 @@ const buildSearchBarResults = async (results, parentContainer) => {
             const movieOverview = document.createElement('p');
 
             movieLink.classList.add("search-result", "container-fluid", "p-2", "d-flex", "border-bottom", "text-decoration-none", "link-dark");
-            if (results.length === 1)
+            if (results.length === 1 && !append)
                 movieLink.classList.add("rounded");
-            if (index === 0)
+            if (index === 0 && !append)
                 movieLink.classList.add("rounded-top");
             if (index === results.length - 1) {
                 movieLink.classList.add("rounded-bottom");
@@ -79,7 +110,7 @@ const buildSearchBarResults = async (results, parentContainer) => {
             movieOverview.classList.add("search-bar-overview");
 
             if (movie.poster_path)
-                moviePoster.src = `https://image.tmdb.org/t/p/w92${movie.poster_path}`;
+                moviePoster.src = `/poster/w92${movie.poster_path}`;
             else
                 moviePoster.src = "/static/imgs/image-not-found-vector.jpg";
             movieTitle.textContent = movie.original_title;
@@ -165,4 +196,14 @@ if (searchPageWrapper) {
             fetchSearchResult(searchValue.textContent, searchPageWrapper);
         }
     })();
+
+    // Load the next page of results when scrolled near the bottom
+    window.addEventListener("scroll", () => {
+        if (!searchValue.textContent || searchPageState.loading
+        || searchPageState.page >= searchPageState.totalPages) return;
+        if (window.innerHeight + window.scrollY < document.body.offsetHeight - 300) return;
+        searchPageState.loading = true;
+        fetchSearchResult(searchValue.textContent, searchPageWrapper, searchPageState.page + 1)
+        .finally(() => { searchPageState.loading = false; });
+    })
 }
\ No newline at end of file
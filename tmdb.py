@@ -0,0 +1,259 @@
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from email.utils import parsedate_to_datetime
+from external_variables import TMDB_API_KEY, TMDB_ASYNC_MAX_CONNECTIONS, TMDB_BACKOFF, TMDB_BASE_URL, TMDB_CONNECT_TIMEOUT, TMDB_ENDPOINT_TIMEOUTS, TMDB_MAX_RETRY_AFTER, TMDB_POOL_SIZE, TMDB_POOL_TIMEOUT, TMDB_READ_TIMEOUT, TMDB_RETRIES, TMDB_RETRY_STATUSES
+from metrics import UPSTREAM_DURATION, observe
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+import aiohttp, asyncio, requests, threading, time
+
+# Shared by both clients so calls from sync and async views trip and reset the same breaker
+tmdb_breaker = CircuitBreaker("tmdb")
+
+
+class CappedRetry(Retry):
+    """Retry that waits at most TMDB_MAX_RETRY_AFTER seconds, however long a Retry-After header asks for"""
+
+    def get_retry_after(self, response):
+        seconds = super().get_retry_after(response)
+        return None if seconds is None else min(seconds, TMDB_MAX_RETRY_AFTER)
+
+
+class TimedPoolMixin:
+    """Connection pool that waits TMDB_POOL_TIMEOUT seconds for a free connection instead of forever"""
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(TMDB_POOL_TIMEOUT if timeout is None else timeout)
+
+
+class TimedHTTPConnectionPool(TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TimedHTTPSConnectionPool(TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class TimedPoolAdapter(HTTPAdapter):
+    """HTTPAdapter whose blocking pools give up on a free connection after TMDB_POOL_TIMEOUT seconds"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class EndpointStats:
+    """Latency counters for each TMDB endpoint a client calls, which also feed the circuit breaker"""
+
+    # Client label of the calls in the upstream latency histogram
+    client_name = "sync"
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, endpoint, elapsed, error, unavailable):
+        """
+            Adds one call to the latency counters for the endpoint.
+            Parameters:
+            - endpoint (str): name the call is counted under
+            - elapsed (float): seconds the call took, retries included
+            - error (bool): the call raised or got an error status
+            - unavailable (bool): the call raised or got a 429/5xx status, counted by the breaker
+        """
+        self.breaker.after_call(elapsed, unavailable)
+        with self._stats_lock:
+            stat = self._stats.setdefault(endpoint, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stat["count"] += 1
+            stat["total_seconds"] += elapsed
+            stat["max_seconds"] = max(stat["max_seconds"], elapsed)
+            if error:
+                stat["errors"] += 1
+        observe(UPSTREAM_DURATION, f"tmdb-{endpoint}", elapsed, self.client_name, endpoint, "error" if error else "ok")
+
+    def stats(self):
+        """Returns a copy of the latency counters for each endpoint"""
+        with self._stats_lock:
+            return {endpoint: dict(stat) for endpoint, stat in self._stats.items()}
+
+
+class TMDBClient(EndpointStats):
+    """
+        Shared client for every call to the TMDB api.
+        Keeps connections alive in a pool so a page making several calls
+        only pays for one TLS handshake, retries 429/5xx responses with
+        backoff and keeps latency counters for each endpoint. Calls raise
+        CircuitOpenError without being made while the breaker is open.
+    """
+
+    def __init__(self, base_url=TMDB_BASE_URL, api_key=TMDB_API_KEY, pool_size=TMDB_POOL_SIZE,
+                 connect_timeout=TMDB_CONNECT_TIMEOUT, read_timeout=TMDB_READ_TIMEOUT,
+                 endpoint_timeouts=TMDB_ENDPOINT_TIMEOUTS, retries=TMDB_RETRIES, backoff=TMDB_BACKOFF, breaker=tmdb_breaker):
+        super().__init__(breaker)
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.endpoint_timeouts = {endpoint: (connect_timeout, seconds) for endpoint, seconds in endpoint_timeouts.items()}
+        self.session = requests.Session()
+
+        # Retry only idempotent GETs, hand back the last response once retries run out.
+        # A response that timed out isn't retried, waiting for a slow TMDB again only piles up workers
+        retry = CappedRetry(
+            total=retries,
+            read=0,
+            backoff_factor=backoff,
+            status_forcelist=TMDB_RETRY_STATUSES,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = TimedPoolAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, endpoint, path, **params):
+        """
+            Makes a GET request to the TMDB api and returns the response.
+            Parameters:
+            - endpoint (str): name the call is counted under in stats()
+            - path (str): path after the base url, ex: /movie/550
+            - params: query string parameters, api key is added automatically
+        """
+        self.breaker.before_call()
+        params["api_key"] = self.api_key
+        start = time.perf_counter()
+        error = unavailable = False
+        try:
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.endpoint_timeouts.get(endpoint, self.timeout))
+            error = response.status_code >= 400
+            unavailable = response.status_code in TMDB_RETRY_STATUSES
+            return response
+        except requests.RequestException:
+            error = unavailable = True
+            raise
+        except EmptyPoolError as e:
+            # Every pooled connection stayed busy, fail like any other unreachable TMDB call
+            error = True
+            raise requests.ConnectionError(e) from e
+        finally:
+            self._record(endpoint, time.perf_counter() - start, error, unavailable)
+
+
+class AsyncTMDBClient(EndpointStats):
+    """
+        Asyncio client for the TMDB api, awaitable from any event loop.
+        Flask runs each async view on its own short lived event loop, so the
+        connection pool lives on one long running loop in a daemon thread and
+        calls are handed to it. Every async view shares the same keep-alive
+        connections, with up to max_connections calls in flight at once.
+    """
+
+    client_name = "async"
+
+    def __init__(self, base_url=TMDB_BASE_URL, api_key=TMDB_API_KEY, max_connections=TMDB_ASYNC_MAX_CONNECTIONS,
+                 connect_timeout=TMDB_CONNECT_TIMEOUT, read_timeout=TMDB_READ_TIMEOUT,
+                 endpoint_timeouts=TMDB_ENDPOINT_TIMEOUTS, retries=TMDB_RETRIES, backoff=TMDB_BACKOFF, breaker=tmdb_breaker):
+        super().__init__(breaker)
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.endpoint_timeouts = {endpoint: aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=seconds)
+                                  for endpoint, seconds in endpoint_timeouts.items()}
+        self.retries = retries
+        self.backoff = backoff
+        self._loop = None
+        self._session = None
+        self._loop_lock = threading.Lock()
+
+    def _get_loop(self):
+        """Returns the client's event loop, starting its thread on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="tmdb-async", daemon=True).start()
+            return self._loop
+
+    async def get(self, endpoint, path, **params):
+        """
+            Makes a GET request to the TMDB api and returns an AsyncResponse.
+            Parameters:
+            - endpoint (str): name the call is counted under in stats()
+            - path (str): path after the base url, ex: /movie/550
+            - params: query string parameters, api key is added automatically
+        """
+        self.breaker.before_call()
+        loop = self._get_loop()
+        call = self._get(endpoint, path, params)
+        if asyncio.get_running_loop() is loop:
+            return await call
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call, loop))
+
+    async def _get(self, endpoint, path, params):
+        """Runs on the client's loop, retries 429/5xx responses and connection errors with backoff"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_connections))
+        if self.api_key is not None:
+            params["api_key"] = self.api_key
+        timeout = self.endpoint_timeouts.get(endpoint, self.timeout)
+        start = time.perf_counter()
+        error = unavailable = False
+        try:
+            for attempt in range(self.retries + 1):
+                last_attempt = attempt == self.retries
+                try:
+                    async with self._session.get(f"{self.base_url}{path}", params=params, timeout=timeout) as response:
+                        response = AsyncResponse(response.status, response.headers, await response.read())
+                except asyncio.TimeoutError:
+                    # Not retried, see TMDBClient
+                    raise
+                except aiohttp.ClientConnectionError:
+                    if last_attempt:
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                    continue
+                if last_attempt or response.status_code not in TMDB_RETRY_STATUSES:
+                    error = not response.ok
+                    unavailable = response.status_code in TMDB_RETRY_STATUSES
+                    return response
+                await asyncio.sleep(min(retry_after(response) or self.backoff * 2 ** attempt, TMDB_MAX_RETRY_AFTER))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            error = unavailable = True
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - start, error, unavailable)
+
+
+class AsyncResponse:
+    """Status, headers and body of a finished AsyncTMDBClient call, named like a requests response"""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers
+        self.content = content
+
+
+def retry_after(response):
+    """Returns the seconds a Retry-After header asks to wait, or None if it has none"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Exceptions a call from either client raises when TMDB can't be reached, answered from local data
+TMDB_ERRORS = (CircuitOpenError, requests.RequestException, aiohttp.ClientError, asyncio.TimeoutError)
+
+# One client of each kind per worker process, shared by all helpers
+tmdb_client = TMDBClient()
+async_tmdb_client = AsyncTMDBClient()